@@ -1,8 +1,32 @@
 import json
 import os
+import re
+import sqlite3
+import sys
+import asyncio
+import base64
+import bisect
+import hashlib
+import heapq
+import hmac
+import itertools
+import lzma
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from typing import List, Optional
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response as RawResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = FastAPI()
 
@@ -12,6 +36,26 @@ BOOKS_FILE = os.path.join(FILES_DIR, 'books.json')
 USERS_FILE = os.path.join(FILES_DIR, 'readers.json')
 TICKETS_FILE = os.path.join(FILES_DIR, 'tickets.json')
 
+# Бэкенд хранения: json (файлы целиком), journal (журнал + снимки) или sqlite.
+STORAGE_BACKEND = os.environ.get('LIBRARY_STORAGE', 'json')
+JOURNAL_DIR = os.path.join(FILES_DIR, 'journal')
+SQLITE_FILE = os.environ.get('LIBRARY_SQLITE_FILE', os.path.join(FILES_DIR, 'library.db'))
+
+# Групповая фиксация записей: окно ожидания в мс (0 - каждая запись сразу) и размер пакета.
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('LIBRARY_GROUP_COMMIT_MS', '0'))
+GROUP_COMMIT_BATCH_SIZE = int(os.environ.get('LIBRARY_GROUP_COMMIT_BATCH', '256'))
+
+# Ключ подписи токенов (без него токены живут до перезапуска сервера) и время жизни сессии в секундах.
+SESSION_SECRET = os.environ.get('LIBRARY_SECRET', '').encode('utf-8') or os.urandom(32)
+SESSION_TTL = int(os.environ.get('LIBRARY_SESSION_TTL', str(8 * 60 * 60)))
+
+# Архив закрытых билетов: через сколько дней после закрытия билет уходит в архив
+# и как часто (в секундах, 0 - никогда) запускается перенос.
+ARCHIVE_DIR = os.path.join(FILES_DIR, 'archive')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('LIBRARY_ARCHIVE_DAYS', '180'))
+ARCHIVE_INTERVAL = int(os.environ.get('LIBRARY_ARCHIVE_INTERVAL', '3600'))
+ARCHIVE_SEGMENT_SIZE = 10_000
+
 # ======
 # Сущности
 # ======
@@ -39,6 +83,11 @@ class ReaderTicket(BaseModel):
     books: List[str] = []
     date_issue: str
     date_return: str
+    id: Optional[int] = None
+    # Уже возвращённые книги билета; когда возвращены все, билет закрывается.
+    returned: List[str] = []
+    closed: bool = False
+    date_closed: Optional[str] = None
 
 # ======
 # Вспомогательные функции
@@ -53,14 +102,1413 @@ def load_json(filepath):
     except:
         return []
 
-def save_json(filepath, data):
-    with open(filepath, 'w', encoding="utf-8") as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+def save_json(filepath, data, indent=4):
+    # Пишем во временный файл и подменяем его атомарно, чтобы сбой посреди записи не портил данные.
+    temp_path = filepath + '.tmp'
+    with open(temp_path, 'w', encoding="utf-8") as file:
+        # dumps, а не dump: без отступов так работает быстрый кодировщик на C.
+        file.write(json.dumps(data, ensure_ascii=False, indent=indent))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, filepath)
+
+# Сериализация в компактный JSON-байты: orjson, если установлен, иначе стандартный json.
+def dumps_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+DATE_FORMAT = '%d.%m.%Y'
+
+# Даты хранятся строками дд.мм.гггг; разобранное значение запоминается, повторно строка не разбирается.
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+def format_date(value):
+    return value.strftime(DATE_FORMAT)
+
+# ======
+# Пароли
+# ======
+
+PASSWORD_SCHEME = 'pbkdf2_sha256'
+PASSWORD_ITERATIONS = 200_000
+
+def hash_password(password):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PASSWORD_ITERATIONS)
+    return f'{PASSWORD_SCHEME}${PASSWORD_ITERATIONS}${salt.hex()}${digest.hex()}'
+
+def is_password_hash(value):
+    return bool(value) and value.startswith(PASSWORD_SCHEME + '$')
+
+def verify_password(password, stored):
+    if not stored:
+        return False
+    if not is_password_hash(stored):
+        # Старые записи с паролем в открытом виде (до миграции).
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    _, iterations, salt, digest = stored.split('$')
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate, bytes.fromhex(digest))
+
+# Кеш недавно проверенных входов: (логин, хеш из базы) -> быстрый HMAC пароля.
+# Повторный вход не платит за медленный KDF, а смена пароля меняет ключ кеша.
+class LoginCache:
+    def __init__(self, size=1024):
+        self.size = size
+        self.secret = os.urandom(32)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def fingerprint(self, password):
+        return hmac.new(self.secret, password.encode('utf-8'), hashlib.sha256).digest()
+
+    def check(self, login, stored, password):
+        with self.lock:
+            cached = self.entries.get((login, stored))
+            if cached is not None:
+                self.entries.move_to_end((login, stored))
+        return cached is not None and hmac.compare_digest(cached, self.fingerprint(password))
+
+    def remember(self, login, stored, password):
+        with self.lock:
+            self.entries[(login, stored)] = self.fingerprint(password)
+            self.entries.move_to_end((login, stored))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+login_cache = LoginCache()
+
+# ======
+# Сессии
+# ======
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+class Session(BaseModel):
+    session_id: str
+    card_number: int
+    role: str
+    expires: float
+
+# Таблица сессий в памяти. Токен - подписанный HMAC идентификатор сессии, поэтому
+# проверка не обращается к хранилищу: подпись + поиск в словаре.
+class SessionTable:
+    def __init__(self, secret, ttl):
+        self.secret = secret
+        self.ttl = ttl
+        self.sessions = {}
+        self.last_sweep = time.monotonic()
+        self.lock = threading.Lock()
+
+    def sign(self, payload):
+        return b64encode(hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def create(self, user):
+        session = Session(
+            session_id=b64encode(os.urandom(16)),
+            card_number=user.card_number,
+            role=user.role,
+            expires=time.time() + self.ttl
+        )
+        with self.lock:
+            self.sessions[session.session_id] = session
+            self.sweep()
+
+        payload = b64encode(json.dumps({'sid': session.session_id, 'exp': int(session.expires)}).encode('utf-8'))
+        return f'{payload}.{self.sign(payload)}'
+
+    def verify(self, token):
+        payload, _, signature = token.partition('.')
+        if not signature or not hmac.compare_digest(signature, self.sign(payload)):
+            return None
+        try:
+            session_id = json.loads(b64decode(payload))['sid']
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        session = self.sessions.get(session_id)
+        if session is None or session.expires < time.time():
+            return None
+        return session
+
+    def drop(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    # Просроченные сессии вычищаются не чаще раза в минуту.
+    def sweep(self):
+        if time.monotonic() - self.last_sweep < 60:
+            return
+        now = time.time()
+        for session_id in [sid for sid, session in self.sessions.items() if session.expires < now]:
+            del self.sessions[session_id]
+        self.last_sweep = time.monotonic()
+
+sessions = SessionTable(SESSION_SECRET, SESSION_TTL)
+
+def current_session(authorization: Optional[str] = Header(None)):
+    scheme, _, token = (authorization or '').partition(' ')
+    session = sessions.verify(token) if scheme.lower() == 'bearer' else None
+    if session is None:
+        raise HTTPException(status_code=401, detail='Требуется авторизация', headers={'WWW-Authenticate': 'Bearer'})
+    return session
+
+def staff_session(session: Session = Depends(current_session)):
+    if session.role != 'Администратор':
+        raise HTTPException(status_code=403, detail='Недостаточно прав')
+    return session
+
+# ======
+# Хранилище
+# ======
+
+def by_field(name):
+    return lambda item: (getattr(item, name),)
+
+# Вторичный индекс: уникальный (ключ -> запись) или множественный (ключ -> список записей).
+class Index:
+    def __init__(self, keys, unique=False):
+        self.keys = keys
+        self.unique = unique
+        self.entries = {}
+
+    # Индекс собирается в отдельном словаре и подменяется целиком, чтобы читатели не видели его наполовину.
+    def rebuild(self, items):
+        entries = {}
+        for item in items:
+            self.add(item, entries)
+        self.entries = entries
+
+    def add(self, item, entries=None):
+        entries = self.entries if entries is None else entries
+        for key in self.keys(item):
+            if key is None:
+                continue
+            if self.unique:
+                # При дублях в старых данных побеждает первая запись, как и при линейном поиске.
+                entries.setdefault(key, item)
+            else:
+                entries.setdefault(key, []).append(item)
+
+    def remove(self, item):
+        for key in self.keys(item):
+            if self.unique:
+                if self.entries.get(key) is item:
+                    del self.entries[key]
+            elif key in self.entries:
+                # Сравнение по is: == у моделей сравнивает все поля и на длинном списке заметно дороже.
+                remaining = [entry for entry in self.entries[key] if entry is not item]
+                if remaining:
+                    self.entries[key] = remaining
+                else:
+                    del self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        if self.unique:
+            return self.entries.get(key)
+        return self.entries.get(key, [])
+
+# Упорядоченный индекс: записи отсортированы по ключу, выборка диапазона за O(log n + k).
+# key возвращает сравнимый ключ (уникальный, например с номером записи в конце) или None,
+# если запись в индекс не попадает.
+class SortedIndex:
+    def __init__(self, key):
+        self.key = key
+        self.keys = []
+        self.items = []
+
+    def rebuild(self, items):
+        entries = sorted(
+            ((key, item) for key, item in ((self.key(item), item) for item in items) if key is not None),
+            key=lambda entry: entry[0]
+        )
+        self.keys, self.items = [key for key, item in entries], [item for key, item in entries]
+
+    def add(self, item):
+        key = self.key(item)
+        if key is None:
+            return
+        position = bisect.bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.items.insert(position, item)
+
+    def remove(self, item):
+        key = self.key(item)
+        if key is None:
+            return
+        position = bisect.bisect_left(self.keys, key)
+        while position < len(self.keys) and self.keys[position] == key:
+            if self.items[position] is item:
+                del self.keys[position]
+                del self.items[position]
+                return
+            position += 1
+
+    # Записи с ключом в полуинтервале [low, high); None — без ограничения.
+    def range(self, low=None, high=None):
+        keys, items = self.keys, self.items
+        start = 0 if low is None else bisect.bisect_left(keys, low)
+        end = len(keys) if high is None else bisect.bisect_left(keys, high)
+        return items[start:end]
+
+# Приведение к нижнему регистру с учётом кириллицы (ё и е не различаем).
+def normalize_text(value):
+    return str(value).casefold().replace('ё', 'е')
+
+def tokenize(value):
+    return re.findall(r'\w+', normalize_text(value))
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+# Словарь поискового индекса: слово -> ключи записей, отсортированные слова для поиска
+# по префиксу и триграммы -> слова для поиска по подстроке.
+class SearchTerms:
+    def __init__(self):
+        self.docs = {}
+        self.doc_tokens = {}
+        self.order = {}
+        self.terms = {}
+        self.sorted_terms = []
+        self.trigrams = {}
+
+    def add(self, key, item, tokens, keep_sorted=True):
+        self.docs[key] = item
+        self.doc_tokens[key] = tokens
+        self.order.setdefault(key, len(self.order))
+        for token in tokens:
+            if token not in self.terms:
+                self.terms[token] = set()
+                if keep_sorted:
+                    bisect.insort(self.sorted_terms, token)
+                else:
+                    self.sorted_terms.append(token)
+                for trigram in trigrams(token):
+                    self.trigrams.setdefault(trigram, set()).add(token)
+            self.terms[token].add(key)
+
+    # Слова без записей остаются в словаре: они безвредны и пропадут при пересборке.
+    def remove(self, key):
+        for token in self.doc_tokens.pop(key, ()):
+            self.terms[token].discard(key)
+        self.docs.pop(key, None)
+
+# Полнотекстовый индекс коллекции: совпадение слова целиком, по префиксу и по подстроке (триграммы).
+class SearchIndex:
+    EXACT, PREFIX, INFIX = 3, 2, 1
+    SCAN_LIMIT = 2000
+
+    def __init__(self, fields, key):
+        self.fields = fields
+        self.key = key
+        self.data = SearchTerms()
+
+    def tokens(self, item):
+        return {token for field in self.fields for token in tokenize(getattr(item, field))}
+
+    def rebuild(self, items):
+        data = SearchTerms()
+        for item in items:
+            data.add(getattr(item, self.key), item, self.tokens(item), keep_sorted=False)
+        data.sorted_terms.sort()
+        self.data = data
+
+    def add(self, item):
+        self.data.add(getattr(item, self.key), item, self.tokens(item))
+
+    def remove(self, item):
+        self.data.remove(getattr(item, self.key))
+
+    # Оценка совпадения слова записи со словом запроса.
+    def score_token(self, token, term):
+        if token == term:
+            return self.EXACT
+        if token.startswith(term):
+            return self.PREFIX
+        if len(term) >= 3 and term in token:
+            return self.INFIX
+        return 0
+
+    # Оценка каждой записи по одному слову запроса: лучшее из совпадений её слов.
+    # Поиск идёт без блокировки коллекции, поэтому множества индекса, которые может
+    # пополнять запись, перебираются по снимку (tuple/set копируются целиком под GIL).
+    def match_term(self, data, term):
+        scores = {}
+
+        def mark(token, score):
+            for key in tuple(data.terms.get(token, ())):
+                if scores.get(key, 0) < score:
+                    scores[key] = score
+
+        position = bisect.bisect_left(data.sorted_terms, term)
+        while position < len(data.sorted_terms) and data.sorted_terms[position].startswith(term):
+            token = data.sorted_terms[position]
+            mark(token, self.EXACT if token == term else self.PREFIX)
+            position += 1
+
+        if len(term) >= 3:
+            candidates = None
+            for trigram in trigrams(term):
+                tokens = data.trigrams.get(trigram, set())
+                candidates = set(tokens) if candidates is None else candidates & tokens
+                if not candidates:
+                    break
+            for token in candidates or ():
+                if term in token and not token.startswith(term):
+                    mark(token, self.INFIX)
+
+        return scores
+
+    # Примерное число записей под слово запроса (по префиксу): чем меньше, тем раньше его проверяем.
+    def estimate(self, data, term):
+        count = 0
+        position = bisect.bisect_left(data.sorted_terms, term)
+        while position < len(data.sorted_terms) and data.sorted_terms[position].startswith(term):
+            count += len(data.terms[data.sorted_terms[position]])
+            position += 1
+        return count
+
+    # Записи, подходящие под все слова запроса, по убыванию релевантности.
+    # Возвращает общее число совпадений и первые count записей.
+    def search(self, query, predicate=None, count=None):
+        data = self.data
+        terms = sorted(set(tokenize(query)), key=lambda term: (self.estimate(data, term), -len(term)))
+        if not terms:
+            return 0, []
+
+        # Самое избирательное слово ищем по индексу. Остальные, когда кандидатов
+        # немного, проверяем прямо по словам найденных записей.
+        total = self.match_term(data, terms[0])
+        for term in terms[1:]:
+            if len(total) > self.SCAN_LIMIT:
+                scores = self.match_term(data, term)
+                total = {key: total[key] + score for key, score in scores.items() if key in total}
+            else:
+                narrowed = {}
+                for key, score in total.items():
+                    best = max((self.score_token(token, term) for token in data.doc_tokens.get(key, ())), default=0)
+                    if best:
+                        narrowed[key] = score + best
+                total = narrowed
+            if not total:
+                return 0, []
+
+        # Записи, удалённые во время поиска, отбрасываются.
+        docs = {key: data.docs.get(key) for key in total}
+        total = {
+            key: score for key, score in total.items()
+            if docs[key] is not None and (predicate is None or predicate(docs[key]))
+        }
+
+        rank = lambda key: (-total[key], data.order[key])
+        ranked = sorted(total, key=rank) if count is None else heapq.nsmallest(count, total, key=rank)
+        return len(total), [docs[key] for key in ranked]
+
+# Бэкенд на JSON-файлах: каждая запись переписывает файл коллекции целиком.
+class JsonBackend:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.json')
+
+    def load(self, name):
+        return load_json(self.path(name))
+
+    # Отпечаток файла (mtime + размер), по которому видно изменения извне.
+    def stamp(self, name):
+        return file_stamp(self.path(name))
+
+    def write(self, collection, changes):
+        save_json(self.path(collection.name), [item.dict() for item in collection.items])
+
+    def rewrite(self, collection):
+        self.write(collection, [])
+
+# Бэкенд с журналом: изменения дописываются в JSONL-журнал, а снимок периодически
+# пересобирается и подменяется через rename.
+class JournalBackend:
+    def __init__(self, directory, source_directory, compact_every=1000):
+        self.directory = directory
+        self.source_directory = source_directory
+        self.compact_every = compact_every
+        self.sequences = {}
+        self.journal_sizes = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def snapshot_path(self, name):
+        return os.path.join(self.directory, f'{name}.snapshot.json')
+
+    def journal_path(self, name):
+        return os.path.join(self.directory, f'{name}.journal.jsonl')
+
+    def load(self, name):
+        snapshot_path = self.snapshot_path(name)
+
+        # Первый запуск: исходный JSON-файл становится начальным снимком.
+        if not os.path.exists(snapshot_path):
+            rows = load_json(os.path.join(self.source_directory, f'{name}.json'))
+            save_json(snapshot_path, {'seq': 0, 'rows': rows})
+            print(f'Данные {name}.json импортированы в журнал.')
+
+        snapshot = load_json(snapshot_path)
+        rows = snapshot.get('rows', []) if isinstance(snapshot, dict) else []
+        sequence = snapshot.get('seq', 0) if isinstance(snapshot, dict) else 0
+
+        journal_size = 0
+        replay = JournalReplay(rows)
+        for entry in read_journal(self.journal_path(name)):
+            # Записи, уже попавшие в снимок, пропускаем (сбой между компактификацией и очисткой журнала).
+            if entry['seq'] <= sequence:
+                continue
+            replay.apply(entry)
+            sequence = entry['seq']
+            journal_size += 1
+
+        self.sequences[name] = sequence
+        self.journal_sizes[name] = journal_size
+        return replay.result()
+
+    def stamp(self, name):
+        return file_stamp(self.snapshot_path(name)), file_stamp(self.journal_path(name))
+
+    def write(self, collection, changes):
+        name = collection.name
+        sequence = self.sequences.get(name, 0)
+
+        lines = []
+        for op, row in changes:
+            sequence += 1
+            entry = {'seq': sequence, 'op': op, 'row': row}
+            if op != 'insert':
+                entry['key'] = collection.key
+            lines.append(json.dumps(entry, ensure_ascii=False) + '\n')
+
+        with open(self.journal_path(name), 'a', encoding='utf-8') as file:
+            file.writelines(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.sequences[name] = sequence
+        self.journal_sizes[name] = self.journal_sizes.get(name, 0) + len(lines)
+
+        if self.journal_sizes[name] >= self.compact_every:
+            self.compact(collection)
+
+    def rewrite(self, collection):
+        self.compact(collection)
+
+    def compact(self, collection):
+        name = collection.name
+        rows = [item.dict() for item in collection.items]
+        save_json(self.snapshot_path(name), {'seq': self.sequences.get(name, 0), 'rows': rows})
+        with open(self.journal_path(name), 'w', encoding='utf-8') as file:
+            file.flush()
+            os.fsync(file.fileno())
+        self.journal_sizes[name] = 0
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    code TEXT PRIMARY KEY,
+    author TEXT NOT NULL,
+    name TEXT NOT NULL,
+    year_publication INTEGER NOT NULL,
+    sign_novelty_and_annotations TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS readers (
+    card_number INTEGER PRIMARY KEY,
+    surname TEXT NOT NULL,
+    name TEXT NOT NULL,
+    patronymic TEXT NOT NULL,
+    address TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    login TEXT,
+    password TEXT,
+    role TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    reader_card_number INTEGER NOT NULL,
+    date_issue TEXT NOT NULL,
+    date_return TEXT NOT NULL,
+    closed INTEGER NOT NULL DEFAULT 0,
+    date_closed TEXT
+);
+CREATE TABLE IF NOT EXISTS ticket_books (
+    ticket_id INTEGER NOT NULL REFERENCES tickets(id),
+    position INTEGER NOT NULL,
+    book_code TEXT NOT NULL,
+    returned INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ticket_id, position)
+);
+"""
+
+# Уникальность логина и телефона, как у индексов в памяти. Создаются после импорта:
+# если в старых данных есть дубли, индекс не создаётся, а данные не теряются.
+SQLITE_UNIQUE_INDEXES = {
+    'readers_login_unique': 'readers(login)',
+    'readers_phone_unique': 'readers(phone)',
+}
+
+SQLITE_COLUMNS = {
+    'books': ['code', 'author', 'name', 'year_publication', 'sign_novelty_and_annotations'],
+    'readers': ['card_number', 'surname', 'name', 'patronymic', 'address', 'phone', 'login', 'password', 'role'],
+    'tickets': ['id', 'reader_card_number', 'date_issue', 'date_return', 'closed', 'date_closed'],
+}
+
+# Бэкенд на SQLite (режим WAL): транзакционная запись; данные читаются в память целиком при загрузке.
+class SqliteBackend:
+    def __init__(self, filepath, source_directory=None):
+        is_new = not os.path.exists(filepath)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # FULL: фиксация транзакции ждёт fsync, подтверждённая запись переживает отключение питания.
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.executescript(SQLITE_SCHEMA)
+
+        # Новая база сразу заполняется из JSON-файлов.
+        if is_new and source_directory:
+            import_json_to_sqlite(self, source_directory)
+        self.create_unique_indexes()
+
+    def create_unique_indexes(self):
+        for name, target in SQLITE_UNIQUE_INDEXES.items():
+            try:
+                with self.connection:
+                    self.connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {target}')
+            except sqlite3.IntegrityError:
+                print(f'Индекс {name} не создан: в таблице есть повторяющиеся значения {target}.')
+
+    def load(self, name):
+        with self.lock:
+            columns = ', '.join(SQLITE_COLUMNS[name])
+            if name != 'tickets':
+                return [dict(row) for row in self.connection.execute(f'SELECT {columns} FROM {name} ORDER BY rowid')]
+
+            tickets = {}
+            for row in self.connection.execute(f'SELECT {columns} FROM tickets ORDER BY id'):
+                ticket = dict(row)
+                ticket['books'] = []
+                ticket['returned'] = []
+                tickets[ticket['id']] = ticket
+            for row in self.connection.execute(
+                'SELECT ticket_id, book_code, returned FROM ticket_books ORDER BY ticket_id, position'
+            ):
+                if row['ticket_id'] in tickets:
+                    tickets[row['ticket_id']]['books'].append(row['book_code'])
+                    if row['returned']:
+                        tickets[row['ticket_id']]['returned'].append(row['book_code'])
+            return list(tickets.values())
+
+    # Ключи записей хранятся в самих таблицах, переписывать нечего.
+    def rewrite(self, collection):
+        pass
+
+    # data_version меняется, только когда базу изменило другое соединение.
+    def stamp(self, name):
+        with self.lock:
+            return self.connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def write(self, collection, changes):
+        with self.lock, self.connection:
+            for op, row in changes:
+                if op == 'insert':
+                    self.insert_row(collection.name, row)
+                elif op == 'update':
+                    self.update_row(collection.name, collection.key, row)
+                elif op == 'delete':
+                    self.delete_row(collection.name, collection.key, row)
+
+    def insert_row(self, name, row):
+        columns = SQLITE_COLUMNS[name]
+        placeholders = ', '.join('?' for _ in columns)
+        cursor = self.connection.execute(
+            f'INSERT INTO {name} ({", ".join(columns)}) VALUES ({placeholders})',
+            [row.get(column) for column in columns]
+        )
+        if name == 'tickets':
+            self.insert_ticket_books(cursor.lastrowid, row)
+
+    def update_row(self, name, key, row):
+        columns = [column for column in SQLITE_COLUMNS[name] if column != key]
+        self.connection.execute(
+            f'UPDATE {name} SET {", ".join(f"{column} = ?" for column in columns)} WHERE {key} = ?',
+            [row.get(column) for column in columns] + [row[key]]
+        )
+        if name == 'tickets':
+            self.connection.execute('DELETE FROM ticket_books WHERE ticket_id = ?', (row['id'],))
+            self.insert_ticket_books(row['id'], row)
+
+    def delete_row(self, name, key, row):
+        if name == 'tickets':
+            self.connection.execute('DELETE FROM ticket_books WHERE ticket_id = ?', (row['id'],))
+        self.connection.execute(f'DELETE FROM {name} WHERE {key} = ?', (row[key],))
+
+    def insert_ticket_books(self, ticket_id, row):
+        returned = set(row.get('returned') or [])
+        self.connection.executemany(
+            'INSERT INTO ticket_books (ticket_id, position, book_code, returned) VALUES (?, ?, ?, ?)',
+            [(ticket_id, position, code, code in returned) for position, code in enumerate(row.get('books', []))]
+        )
+
+def import_json_to_sqlite(backend, source_directory):
+    # Записи проходят через модели, чтобы поля, которых нет в старых файлах, получили значения по умолчанию.
+    models = {'books': Book, 'readers': User, 'tickets': ReaderTicket}
+    with backend.lock, backend.connection:
+        for name in SQLITE_COLUMNS:
+            if backend.connection.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]:
+                print(f'Таблица {name} уже заполнена, импорт пропущен.')
+                continue
+            imported = 0
+            for row in load_json(os.path.join(source_directory, f'{name}.json')):
+                try:
+                    backend.insert_row(name, models[name](**row).dict())
+                    imported += 1
+                except ValidationError:
+                    print(f'Пропущена некорректная запись в {name}.json: {row}')
+                except sqlite3.IntegrityError:
+                    print(f'Пропущена дублирующая запись в {name}.json: {row}')
+            print(f'Импортировано записей из {name}.json: {imported}.')
+
+def file_stamp(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def read_journal(filepath):
+    entries = []
+    if not os.path.exists(filepath):
+        return entries
+
+    valid_size = 0
+    with open(filepath, 'rb') as file:
+        for line in file:
+            # Запись без перевода строки недописана, даже если разбирается: следующая
+            # запись склеилась бы с ней, и при новом запуске пропали бы обе.
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            valid_size += len(line)
+
+    # Недописанный хвост после сбоя отрезаем, чтобы новые записи не склеились с ним.
+    if valid_size != os.path.getsize(filepath):
+        print(f'Журнал {os.path.basename(filepath)} обрезан на повреждённой записи.')
+        with open(filepath, 'r+b') as file:
+            file.truncate(valid_size)
+
+    return entries
+
+# Применение журнала к строкам снимка. Позиции строк по значению ключа строятся один раз,
+# удалённые строки только помечаются и выбрасываются в конце, поэтому повтор журнала
+# стоит O(записей + строк), а порядок строк сохраняется.
+class JournalReplay:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        # Поле-ключ -> {значение: [позиции строк]}.
+        self.positions = {}
+
+    def lookup(self, key):
+        positions = self.positions.get(key)
+        if positions is None:
+            positions = {}
+            for position, row in enumerate(self.rows):
+                if row is not None:
+                    positions.setdefault(row.get(key), []).append(position)
+            self.positions[key] = positions
+        return positions
+
+    def apply(self, entry):
+        row = entry['row']
+        if entry['op'] == 'insert':
+            self.rows.append(row)
+            for key, positions in self.positions.items():
+                positions.setdefault(row.get(key), []).append(len(self.rows) - 1)
+        elif entry['op'] == 'update':
+            key = entry['key']
+            positions = self.lookup(key).get(row[key])
+            if positions:
+                self.rows[positions[0]] = row
+        elif entry['op'] == 'delete':
+            key = entry['key']
+            for position in self.lookup(key).pop(row[key], ()):
+                self.rows[position] = None
+
+    def result(self):
+        return [row for row in self.rows if row is not None]
+
+def create_backend():
+    if STORAGE_BACKEND == 'journal':
+        return JournalBackend(JOURNAL_DIR, FILES_DIR)
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteBackend(SQLITE_FILE, FILES_DIR)
+    return JsonBackend(FILES_DIR)
+
+# Ожидание, пока пакет с изменением не будет записан на диск.
+class PendingCommit:
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+    def done(self, error=None):
+        self.error = error
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        if self.error:
+            raise self.error
+
+# Групповая фиксация: изменения, пришедшие в течение окна (или до размера пакета),
+# записываются одним вызовом бэкенда с одним fsync.
+class GroupCommitter:
+    def __init__(self, window, batch_size):
+        self.window = window
+        self.batch_size = batch_size
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.pending_count = 0
+        self.thread = None
+
+    def submit(self, collection, changes, published, undo):
+        commit = PendingCommit()
+        with self.condition:
+            self.pending.setdefault(collection, []).append((changes, published, undo, commit))
+            self.pending_count += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return commit
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = time.monotonic() + self.window
+                while self.pending_count < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                collections = list(self.pending)
+
+            for collection in collections:
+                self.flush(collection)
+
+    def flush(self, collection):
+        # Пакет забирается под блокировкой коллекции: в памяти ровно записанное + этот пакет,
+        # что важно для компактификации журнала.
+        with collection.lock:
+            with self.condition:
+                batch = self.pending.pop(collection, [])
+                self.pending_count -= len(batch)
+            if not batch:
+                return
+
+            # Клиенты узнают об изменениях пакета только после записи; при сбое
+            # изменения откатываются в обратном порядке, начиная с последнего.
+            error = None
+            try:
+                collection.save([change for changes, published, undo, commit in batch for change in changes])
+            except Exception as exception:
+                error = exception
+                for changes, published, undo, commit in reversed(batch):
+                    undo()
+            else:
+                for changes, published, undo, commit in batch:
+                    collection.publish(published)
+
+        for changes, published, undo, commit in batch:
+            commit.done(error)
+
+def create_committer():
+    if GROUP_COMMIT_WINDOW_MS > 0:
+        return GroupCommitter(GROUP_COMMIT_WINDOW_MS / 1000, GROUP_COMMIT_BATCH_SIZE)
+    return None
+
+# Журнал изменений для синхронизации клиентов: у каждого изменения свой номер,
+# номера идут подряд. Курсор клиента - идентификатор запуска и номер ("эпоха.номер"):
+# номера нового запуска начинаются заново, и курсор прошлого запуска всегда
+# получает полную выгрузку, сколько бы изменений ни было в каждом из запусков.
+class ChangeLog:
+    def __init__(self, size=100_000):
+        self.size = size
+        self.entries = []
+        self.epoch = b64encode(os.urandom(6))
+        self.base = 0
+        self.last = self.base
+        self.lock = threading.Lock()
+        # Подписчики потока событий: (цикл событий, asyncio.Event).
+        self.subscribers = set()
+
+    def record(self, collection, op, item):
+        with self.lock:
+            self.last += 1
+            self.entries.append((self.last, collection, op, item))
+            if len(self.entries) > 2 * self.size:
+                self.entries = self.entries[-self.size:]
+
+    # Изменения, которые нельзя выразить дельтой (перечитали данные с диска): клиентам нужна полная выгрузка.
+    def reset(self):
+        with self.lock:
+            self.last += 1
+            self.entries = []
+            self.base = self.last
+
+    def cursor(self, number):
+        return f'{self.epoch}.{number}'
+
+    # Номер изменения из курсора этого запуска; None для курсора другого запуска или испорченного.
+    def position(self, cursor):
+        epoch, _, number = (cursor or '').rpartition('.')
+        return int(number) if epoch == self.epoch and number.isdigit() else None
+
+    # Изменения после курсора since и текущий курсор; вместо изменений None, если дельту собрать нельзя.
+    def since(self, since):
+        position = self.position(since)
+        with self.lock:
+            first = self.entries[0][0] if self.entries else self.last + 1
+            if position is None or position < self.base or position > self.last or position < first - 1:
+                return None, self.cursor(self.last)
+            return self.entries[position - first + 1:], self.cursor(self.last)
+
+    def subscribe(self):
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    # Будит подписчиков; вызывается из рабочих потоков после записи изменений.
+    def notify(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, event in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Цикл событий уже закрыт.
+                self.unsubscribe((loop, event))
+
+class Collection:
+    def __init__(self, name, model, backend, committer=None, key=None, hidden=None, auto_key=False, changes=None):
+        self.name = name
+        self.model = model
+        self.key = key
+        # Ключи - номера, которые ведёт коллекция: записи без ключа получают следующий номер,
+        # наибольший выданный номер хранится в last_key.
+        self.auto_key = auto_key
+        self.last_key = 0
+        self.changes = changes
+        # Поля, которые не отдаются клиентам в списках.
+        self.hidden = hidden or set()
+        # Сериализованные записи для ответов: ключ -> (запись, JSON-байты без скрытых полей).
+        self.encoded = {}
+        self.backend = backend
+        self.committer = committer
+        self.items = []
+        # Позиция записи в items по ключу: изменение находит запись без прохода по списку.
+        self.positions = {}
+        self.indexes = {}
+        self.views = {}
+        self.version = 0
+        self.stamp = None
+        # Сериализует изменения коллекции; чтение идёт без блокировки.
+        self.lock = threading.RLock()
+        self.local = threading.local()
+
+    def add_index(self, name, index):
+        self.indexes[name] = index
+
+    # При дублях ключа в старых данных, как и в уникальном индексе, побеждает первая запись.
+    def locate(self, items):
+        positions = {}
+        for position, item in enumerate(items):
+            positions.setdefault(getattr(item, self.key), position)
+        return positions
+
+    def position(self, item):
+        position = self.positions.get(getattr(item, self.key))
+        if position is not None and position < len(self.items) and self.items[position] is item:
+            return position
+        # Запись с повторяющимся ключом в карту не попала - ищем её проходом.
+        return next((position for position, existing in enumerate(self.items) if existing is item), None)
+
+    def load(self):
+        with self.lock:
+            stamp = self.backend.stamp(self.name)
+            items = []
+            for row in self.backend.load(self.name):
+                try:
+                    items.append(self.model(**row))
+                except Exception:
+                    print(f'Пропущена некорректная запись в {self.name}: {row}')
+            if self.auto_key:
+                items = self.assign_missing_keys(items)
+            for index in self.indexes.values():
+                index.rebuild(items)
+            self.positions = self.locate(items)
+            self.items = items
+            self.encoded = {}
+            self.version += 1
+            self.stamp = stamp
+            if self.changes is not None:
+                self.changes.reset()
+
+    # Старым записям без ключа выдаём номера по порядку и сразу сохраняем их,
+    # чтобы номера не менялись между запусками.
+    def assign_missing_keys(self, items):
+        # Номера не уменьшаются: ключи записей, ушедших в архив, повторно не выдаются.
+        self.last_key = max([self.last_key] + [getattr(item, self.key) or 0 for item in items])
+        if all(getattr(item, self.key) is not None for item in items):
+            return items
+
+        keyed = []
+        for item in items:
+            if getattr(item, self.key) is None:
+                self.last_key += 1
+                item = self.model(**{**item.dict(), self.key: self.last_key})
+            keyed.append(item)
+        self.items = keyed
+        self.backend.rewrite(self)
+        return keyed
+
+    # Перечитываем данные, только если их изменили в обход сервера.
+    def refresh(self):
+        if self.backend.stamp(self.name) != self.stamp:
+            with self.lock:
+                if self.backend.stamp(self.name) != self.stamp:
+                    self.load()
+
+    def all(self):
+        self.refresh()
+        return self.items
+
+    # Записи в заданном порядке (sort='поле' или '-поле') и позиции ключей в нём.
+    # Результат кешируется до следующего изменения коллекции.
+    def ordered(self, sort=None):
+        self.refresh()
+        version = self.version
+        cached = self.views.get(sort)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+
+        items = list(self.items)
+        if sort:
+            field = sort.lstrip('-')
+            items.sort(key=lambda item: (getattr(item, field) is None, getattr(item, field)), reverse=sort.startswith('-'))
+        positions = {str(getattr(item, self.key)): position for position, item in enumerate(items)} if self.key else {}
+
+        self.views[sort] = (version, items, positions)
+        return items, positions
+
+    def index(self, index_name):
+        self.refresh()
+        return self.indexes[index_name]
+
+    def find(self, index_name, key):
+        return self.index(index_name).get(key)
+
+    def save(self, changes):
+        self.backend.write(self, changes)
+        self.stamp = self.backend.stamp(self.name)
+
+    # Блок изменений под блокировкой коллекции. При групповой фиксации ответ ждёт
+    # записи пакета уже после снятия блокировки, чтобы другие запросы попали в тот же пакет.
+    @contextmanager
+    def writing(self):
+        with self.lock:
+            outermost = getattr(self.local, 'commits', None) is None
+            if outermost:
+                self.local.commits = []
+            try:
+                yield
+            finally:
+                commits = self.local.commits
+                if outermost:
+                    self.local.commits = None
+
+        if outermost:
+            for commit in commits:
+                commit.wait()
+            if self.changes is not None:
+                self.changes.notify()
+
+    # Запись изменений в хранилище. Записи, индексы и журнал изменений в памяти уже обновлены;
+    # если запись не удалась, undo возвращает их к прежнему состоянию, а клиенты
+    # (журнал изменений для /sync и /events) узнают только о записанном - published.
+    def commit(self, changes, published, undo):
+        if self.committer is None:
+            try:
+                self.save(changes)
+            except Exception:
+                undo()
+                raise
+            self.publish(published)
+        else:
+            self.local.commits.append(self.committer.submit(self, changes, published, undo))
+
+    def publish(self, published):
+        for op, item in published:
+            self.record(op, item)
+
+    # Откат к прежнему списку записей. Сбой записи - редкость, поэтому индексы
+    # пересобираются целиком, а не откатываются по одной записи.
+    def rollback(self, items):
+        self.items = items
+        self.positions = self.locate(items)
+        for index in self.indexes.values():
+            index.rebuild(items)
+        self.version += 1
+
+    def insert(self, item):
+        self.insert_many([item])
+
+    # Замена записи новой версией с тем же ключом.
+    def update(self, item, new_item):
+        self.update_many([(item, new_item)])
+
+    def update_many(self, replacements):
+        with self.writing():
+            self.refresh()
+            previous = []
+            for item, new_item in replacements:
+                position = self.position(item)
+                if position is None:
+                    continue
+                previous.append((position, item))
+                self.items[position] = new_item
+                key, new_key = getattr(item, self.key), getattr(new_item, self.key)
+                if new_key != key and self.positions.get(key) == position:
+                    del self.positions[key]
+                self.positions.setdefault(new_key, position)
+            for item, new_item in replacements:
+                for index in self.indexes.values():
+                    index.remove(item)
+                    index.add(new_item)
+            self.version += 1
+
+            def undo():
+                items = list(self.items)
+                for position, item in previous:
+                    items[position] = item
+                self.rollback(items)
+
+            self.commit(
+                [('update', new_item.dict()) for item, new_item in replacements],
+                [('update', new_item) for item, new_item in replacements],
+                undo
+            )
+
+    # Вставка пачки записей одной записью в хранилище.
+    def insert_many(self, items):
+        with self.writing():
+            self.refresh()
+            if self.auto_key:
+                items = [self.with_next_key(item) for item in items]
+            start = len(self.items)
+            for item in items:
+                self.positions.setdefault(getattr(item, self.key), len(self.items))
+                self.items.append(item)
+                for index in self.indexes.values():
+                    index.add(item)
+            self.version += 1
+            # Откаты идут в обратном порядке изменений, поэтому к откату вставки она снова в конце списка.
+            self.commit(
+                [('insert', item.dict()) for item in items],
+                [('insert', item) for item in items],
+                lambda: self.rollback(self.items[:start])
+            )
+
+    def remove_many(self, items):
+        with self.writing():
+            self.refresh()
+            removed = {id(item) for item in items}
+            previous = self.items
+            self.items = [item for item in self.items if id(item) not in removed]
+            # Список записей и так пересобран целиком; индексы дешевле пересобрать, чем чистить по одной записи.
+            self.positions = self.locate(self.items)
+            for index in self.indexes.values():
+                index.rebuild(self.items)
+            for item in items:
+                self.encoded.pop(getattr(item, self.key), None)
+            self.version += 1
+            self.commit(
+                [('delete', item.dict()) for item in items],
+                [('delete', item) for item in items],
+                lambda: self.rollback(previous)
+            )
+
+    # JSON-байты записи для ответа. Записи неизменяемы (изменение - это новая запись),
+    # поэтому байты считаются один раз и годятся, пока под ключом лежит тот же объект.
+    def encode(self, item):
+        key = getattr(item, self.key)
+        entry = self.encoded.get(key)
+        if entry is not None and entry[0] is item:
+            return entry[1]
+        # Поля моделей - простые значения и списки строк, уже проверенные при записи,
+        # поэтому сериализуются прямо из __dict__, минуя dict() модели.
+        data = dumps_json({name: value for name, value in item.__dict__.items() if name not in self.hidden})
+        self.encoded[key] = (item, data)
+        return data
+
+    # JSON-байты записей; с проекцией полей (include) без кеша.
+    def encode_many(self, items, include=None):
+        if include is not None:
+            return [dumps_json(item.dict(include=include, exclude=self.hidden)) for item in items]
+        return [self.encode(item) for item in items]
+
+    def with_next_key(self, item):
+        key = getattr(item, self.key)
+        if key is not None:
+            self.last_key = max(self.last_key, key)
+            return item
+        self.last_key += 1
+        return self.model(**{**item.dict(), self.key: self.last_key})
+
+    # Номер следующей записи; вызывается под блокировкой записи коллекции.
+    def next_key(self):
+        return self.last_key + 1
+
+    def record(self, op, item):
+        if self.changes is not None:
+            self.changes.record(self.name, op, item)
+
+# Архив закрытых билетов: неизменяемые сегменты JSONL, сжатые lzma, и манифест со списком сегментов.
+# По манифесту видно, в каких сегментах есть билеты читателя, поэтому история читается лениво.
+class TicketArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.manifest = None
+
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def segments(self):
+        with self.lock:
+            if self.manifest is None:
+                self.manifest = load_json(self.manifest_path())
+            return list(self.manifest)
+
+    def archived_ids(self):
+        return {ticket_id for segment in self.segments() for ticket_id in segment['ids']}
+
+    def last_id(self):
+        return max((segment['last_id'] for segment in self.segments()), default=0)
+
+    # Сегмент сначала целиком пишется на диск и только потом попадает в манифест.
+    def append(self, tickets):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self.segments()
+        filename = f'tickets-{len(segments) + 1:06d}.jsonl.xz'
+        path = os.path.join(self.directory, filename)
+        temp_path = path + '.tmp'
+        text = ''.join(json.dumps(ticket.dict(), ensure_ascii=False) + '\n' for ticket in tickets)
+        with open(temp_path, 'wb') as file:
+            # preset=1 сжимает на порядок быстрее уровня по умолчанию, а файл больше примерно на треть.
+            file.write(lzma.compress(text.encode('utf-8'), preset=1))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+
+        ids = [ticket.id for ticket in tickets]
+        segment = {
+            'file': filename,
+            'count': len(tickets),
+            'ids': ids,
+            'last_id': max(ids),
+            'readers': sorted({ticket.reader_card_number for ticket in tickets}),
+        }
+        with self.lock:
+            self.manifest = segments + [segment]
+            # Без отступов: манифест хранит номера всех билетов архива и пишется быстрым кодировщиком.
+            save_json(self.manifest_path(), self.manifest, indent=None)
+
+    # Строки сегмента; с card_number разбираются только строки, где встречается этот номер.
+    def read(self, segment, card_number=None):
+        marker = None if card_number is None else f'"reader_card_number": {card_number},'
+        with lzma.open(os.path.join(self.directory, segment['file']), 'rt', encoding='utf-8') as file:
+            return [json.loads(line) for line in file if marker is None or marker in line]
+
+    # Билеты читателя из архива, от новых к старым. Сегменты распаковываются по мере чтения.
+    def history(self, card_number):
+        for segment in reversed(self.segments()):
+            if card_number not in segment['readers']:
+                continue
+            rows = [row for row in self.read(segment, card_number) if row['reader_card_number'] == card_number]
+            yield from (ReaderTicket(**row) for row in reversed(rows))
+
+def issued_books(ticket):
+    if ticket.closed:
+        return []
+    return [code for code in ticket.books if code not in ticket.returned]
+
+def due_key(ticket):
+    if ticket.closed:
+        return None
+    try:
+        return parse_date(ticket.date_return), ticket.id or 0
+    except ValueError:
+        return None
+
+# Книги на руках у читателей: номер билета читателя -> коды книг по открытым билетам в порядке выдачи.
+# Обновляется вместе с индексами билетов (выдача, возврат, архивация); у каждого читателя своя версия,
+# поэтому ETag списка его книг не меняется от выдач другим читателям.
+class LoanView:
+    def __init__(self):
+        self.entries = {}
+        self.versions = {}
+        self.counter = 0
+        self.base = 0
+
+    def rebuild(self, items):
+        entries = {}
+        for item in items:
+            self.add(item, entries)
+        self.counter += 1
+        self.base = self.counter
+        self.versions = {}
+        self.entries = entries
+
+    def add(self, ticket, entries=None):
+        target = self.entries if entries is None else entries
+        codes = issued_books(ticket)
+        if not codes:
+            return
+        # Значение - счётчик на случай одной книги в двух билетах в старых данных.
+        books = target.get(ticket.reader_card_number, {})
+        if entries is None:
+            # Опубликованный словарь читателя не меняем: запросы читают его без блокировки.
+            books = dict(books)
+        for code in codes:
+            books[code] = books.get(code, 0) + 1
+        target[ticket.reader_card_number] = books
+        if entries is None:
+            self.touch(ticket.reader_card_number)
+
+    def remove(self, ticket):
+        codes = issued_books(ticket)
+        if ticket.reader_card_number not in self.entries or not codes:
+            return
+        books = dict(self.entries[ticket.reader_card_number])
+        for code in codes:
+            count = books.get(code, 0) - 1
+            if count > 0:
+                books[code] = count
+            else:
+                books.pop(code, None)
+        if books:
+            self.entries[ticket.reader_card_number] = books
+        else:
+            del self.entries[ticket.reader_card_number]
+        self.touch(ticket.reader_card_number)
+
+    def touch(self, card_number):
+        self.counter += 1
+        self.versions[card_number] = self.counter
+
+    def get(self, card_number):
+        return list(self.entries.get(card_number, ()))
+
+    def version(self, card_number):
+        return self.versions.get(card_number, self.base)
+
+class Repository:
+    def __init__(self, backend, committer=None):
+        self.changes = ChangeLog()
+        self.archive = TicketArchive(ARCHIVE_DIR)
+        self.books = Collection('books', Book, backend, committer, key='code', changes=self.changes)
+        self.readers = Collection(
+            'readers', User, backend, committer, key='card_number', hidden={'password'}, auto_key=True,
+            changes=self.changes
+        )
+        self.tickets = Collection('tickets', ReaderTicket, backend, committer, key='id', auto_key=True, changes=self.changes)
+        self.collections = {'books': self.books, 'readers': self.readers, 'tickets': self.tickets}
+
+        self.books.add_index('code', Index(by_field('code'), unique=True))
+        self.books.add_index('search', SearchIndex(['name', 'code', 'author'], 'code'))
+        self.readers.add_index('card_number', Index(by_field('card_number'), unique=True))
+        self.readers.add_index('login', Index(by_field('login'), unique=True))
+        self.readers.add_index('phone', Index(by_field('phone'), unique=True))
+        self.readers.add_index('search', SearchIndex(['surname', 'name', 'card_number'], 'card_number'))
+        self.tickets.add_index('id', Index(by_field('id'), unique=True))
+        self.tickets.add_index('reader_card_number', Index(by_field('reader_card_number')))
+        # Выданные книги: код книги -> открытый билет, по которому она выдана.
+        self.tickets.add_index('issued', Index(issued_books, unique=True))
+        self.tickets.add_index('loans', LoanView())
+        # Открытые билеты по сроку возврата.
+        self.tickets.add_index('due', SortedIndex(due_key))
+
+    def load(self):
+        self.tickets.last_key = self.archive.last_id()
+        for collection in self.collections.values():
+            collection.load()
 
-def get_next_card_id(users):
-    if not users:
-        return 1
-    return max(user['card_number'] for user in users) + 1
+# Дата, с которой отсчитывается возраст закрытого билета.
+def closed_on(ticket):
+    try:
+        return parse_date(ticket.date_closed or ticket.date_return)
+    except ValueError:
+        return None
+
+# Перенос закрытых давнее ARCHIVE_AFTER_DAYS дней билетов в архив. Закрытые билеты больше не меняются,
+# поэтому сжатие идёт без блокировки, а из рабочего набора билеты убираются уже после записи сегмента.
+# Билеты, попавшие в архив при прерванном запуске, просто убираются из рабочего набора.
+def archive_closed_tickets(today=None):
+    cutoff = (today or date.today()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    tickets = repository.tickets
+    archived = repository.archive.archived_ids()
+
+    candidates = []
+    for ticket in tickets.all():
+        if ticket.closed and ticket.id not in archived:
+            closed = closed_on(ticket)
+            if closed is not None and closed < cutoff:
+                candidates.append(ticket)
+
+    for start in range(0, len(candidates), ARCHIVE_SEGMENT_SIZE):
+        repository.archive.append(candidates[start:start + ARCHIVE_SEGMENT_SIZE])
+        archived.update(ticket.id for ticket in candidates[start:start + ARCHIVE_SEGMENT_SIZE])
+
+    with tickets.writing():
+        moved = [ticket for ticket in tickets.all() if ticket.id in archived]
+        if moved:
+            tickets.remove_many(moved)
+    return len(moved)
+
+async def archive_periodically():
+    while True:
+        try:
+            moved = await run_in_threadpool(archive_closed_tickets)
+            if moved:
+                print(f'В архив перенесено билетов: {moved}.')
+        except Exception as exception:
+            print(f'Ошибка архивации билетов: {exception}')
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+repository = Repository(create_backend(), create_committer())
 
 # ======
 # Стандартное заполнение
@@ -117,7 +1565,7 @@ def create_default_users():
                 'address': 'ул. Кирова 122/3',
                 'phone': '+79272371470',
                 'login': 'aorayden',
-                'password': '*<i51V7CEkgS',
+                'password': hash_password('*<i51V7CEkgS'),
                 'role': 'Администратор',
             },
         ]
@@ -171,150 +1619,670 @@ class Response(BaseModel):
     success: bool
     message: str
     user: Optional[User] = None
+    token: Optional[str] = None
+
+class BulkError(BaseModel):
+    row: int
+    message: str
+
+class BulkResponse(BaseModel):
+    success: bool
+    message: str
+    inserted: int = 0
+    errors: List[BulkError] = []
+
+# ===
+# HTTP-кеширование (ETag)
+# ===
+
+# Идентификатор запуска: счётчики версий начинаются заново после перезапуска,
+# поэтому ETag прошлого запуска не должен совпасть с новым.
+SERVER_EPOCH = b64encode(os.urandom(6))
+
+# Готовые тела ответов по (путь, ETag); ETag уже включает версии коллекций и параметры запроса.
+class ResponseCache:
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+response_cache = ResponseCache()
+
+def make_etag(request, collections, versions=()):
+    versions = '.'.join([str(collection.version) for collection in collections] + [str(version) for version in versions])
+    query = hashlib.sha1(str(sorted(request.query_params.multi_items())).encode('utf-8')).hexdigest()[:12]
+    return f'W/"{SERVER_EPOCH}-{versions}-{query}"'
+
+# Ответ списка с ETag: 304, если у клиента актуальная версия, иначе тело из кеша
+# или собранное build() (JSONResponse) и сохранённое в кеш. versions - дополнительные версии данных
+# (например, одного читателя), от которых зависит ответ.
+def cached_response(request, collections, build, versions=()):
+    for collection in collections:
+        collection.refresh()
+    etag = make_etag(request, collections, versions)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+    client_tags = [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]
+    if etag in client_tags:
+        return RawResponse(status_code=304, headers=headers)
+
+    key = (request.url.path, etag)
+    entry = response_cache.get(key)
+    if entry is None:
+        response = build()
+        extra = {name: value for name, value in response.headers.items() if name.startswith('x-')}
+        entry = (response.body, extra)
+        response_cache.put(key, entry)
+
+    body, extra = entry
+    return RawResponse(content=body, media_type='application/json', headers={**extra, **headers})
+
+# ===
+# Постраничная выдача списков
+# ===
+
+# Ответ-список из уже сериализованных записей: тело склеивается из байтов,
+# модели при чтении повторно не проверяются и не сериализуются.
+class EncodedListResponse(RawResponse):
+    media_type = 'application/json'
+
+    def __init__(self, rows, **kwargs):
+        super().__init__(content=b'[' + b','.join(rows) + b']', **kwargs)
+
+class PageParams:
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1),
+        offset: int = Query(0, ge=0),
+        after: Optional[str] = None,
+        sort: Optional[str] = None,
+        fields: Optional[str] = None,
+    ):
+        self.limit = limit
+        self.offset = offset
+        self.after = after
+        self.sort = sort
+        self.fields = fields
+
+def parse_fields(model, fields):
+    if not fields:
+        return None
+    names = {name.strip() for name in fields.split(',') if name.strip()}
+    unknown = names - set(model.__fields__)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    return names
+
+# Страница коллекции с учётом сортировки, курсора after (ключ последней записи) и проекции полей.
+# Общее число записей и курсор следующей страницы отдаются в заголовках, тело остаётся списком.
+def page_response(collection, params, predicate=None):
+    if params.sort and params.sort.lstrip('-') not in collection.model.__fields__:
+        raise HTTPException(status_code=400, detail=f'Нельзя сортировать по полю {params.sort}')
+    include = parse_fields(collection.model, params.fields)
+
+    items, positions = collection.ordered(params.sort)
+
+    start = 0
+    if params.after is not None:
+        if params.after not in positions:
+            raise HTTPException(status_code=400, detail=f'Запись {params.after} не найдена')
+        start = positions[params.after] + 1
+
+    total = len(items) if predicate is None else sum(1 for item in items if predicate(item))
+
+    selected = itertools.islice(items, start, None)
+    if predicate is not None:
+        selected = (item for item in selected if predicate(item))
+    stop = None if params.limit is None else params.offset + params.limit + 1
+    page = list(itertools.islice(selected, params.offset, stop))
+
+    headers = {'X-Total-Count': str(total)}
+    if params.limit is not None and len(page) > params.limit:
+        page = page[:params.limit]
+        headers['X-Next-Cursor'] = str(getattr(page[-1], collection.key))
+
+    return EncodedListResponse(collection.encode_many(page, include), headers=headers)
+
+# Ответ поиска: страница найденных записей и их общее число в заголовке.
+def search_response(collection, q, limit, offset, fields, predicate=None):
+    include = parse_fields(collection.model, fields)
+    total, hits = collection.index('search').search(q, predicate, offset + limit)
+    return EncodedListResponse(collection.encode_many(hits[offset:], include), headers={'X-Total-Count': str(total)})
+
+# Пользователь для ответа клиенту: хеш пароля наружу не отдаём.
+def public_user(user):
+    return User(**{**user.dict(), 'password': None})
+
+def check_credentials(user, password):
+    stored = user.password
+    if login_cache.check(user.login, stored, password):
+        return True
+    if not verify_password(password, stored):
+        return False
+
+    # Пароль в открытом виде заменяем хешем при первом успешном входе.
+    if not is_password_hash(stored):
+        with repository.readers.writing():
+            if repository.readers.find('card_number', user.card_number) is user:
+                stored = hash_password(password)
+                repository.readers.update(user, User(**{**user.dict(), 'password': stored}))
+
+    login_cache.remember(user.login, stored, password)
+    return True
 
 # Авторизация.
 @app.post('/auth/login', response_model=Response)
 def login_user(credentials: LoginRequest):
-    users_data = load_json(USERS_FILE)
-
     found_user = None
 
     if credentials.login and credentials.password:
-        for u in users_data:
-            if u.get('login') == credentials.login and u.get('password') == credentials.password:
-                found_user = u
-                break
+        user = repository.readers.find('login', credentials.login)
+        if user and check_credentials(user, credentials.password):
+            found_user = user
 
+    # По номеру билета входят только читатели: номер не секрет, и сессию сотрудника
+    # можно получить лишь по логину и паролю.
     elif credentials.card_number:
-        for u in users_data:
-            if u.get('card_number') == credentials.card_number:
-                found_user = u
-                break
+        user = repository.readers.find('card_number', credentials.card_number)
+        if user and user.role == 'Читатель':
+            found_user = user
 
     if not found_user:
         return Response(success=False, message="Неверные учётные данные или пользователь не найден.")
 
     return Response(
         success=True,
-        message=f"Добро пожаловать, {found_user['name']} {found_user['patronymic']}!",
-        user=User(**found_user)
+        message=f"Добро пожаловать, {found_user.name} {found_user.patronymic}!",
+        user=public_user(found_user),
+        token=sessions.create(found_user)
     )
 
+# Выход: сессия удаляется, токен больше не принимается.
+@app.post('/auth/logout', response_model=Response)
+def logout_user(session: Session = Depends(current_session)):
+    sessions.drop(session.session_id)
+    return Response(success=True, message="Сессия завершена.")
+
 # Регистрация.
 @app.post('/auth/register', response_model=Response)
-def register_user(new_user_data: UserRegister):
-    users_data = load_json(USERS_FILE)
+def register_user(new_user_data: UserRegister, session: Session = Depends(staff_session)):
+    # Хеширование медленное, поэтому идёт до блокировки, чтобы не задерживать другие записи.
+    user_dict = new_user_data.dict()
+    if user_dict.get('password'):
+        user_dict['password'] = hash_password(user_dict['password'])
 
-    for u in users_data:
-        if u.get('phone') == new_user_data.phone:
+    # Проверка дубля, выбор номера билета и вставка должны пройти атомарно.
+    with repository.readers.writing():
+        if repository.readers.find('phone', new_user_data.phone):
             return Response(success=False, message="Пользователь с таким номером телефона уже существует")
+        if new_user_data.login is not None and repository.readers.find('login', new_user_data.login):
+            return Response(success=False, message="Пользователь с таким логином уже существует")
 
-    new_id = get_next_card_id(users_data)
-
-    user_dict = new_user_data.dict()
-    user_dict['card_number'] = new_id
-
-    users_data.append(user_dict)
-    save_json(USERS_FILE, users_data)
+        new_id = repository.readers.next_key()
+        user_dict['card_number'] = new_id
 
-    created_user = User(**user_dict)
+        created_user = User(**user_dict)
+        repository.readers.insert(created_user)
 
     return Response(
         success=True,
         message=f"Пользователь успешно зарегистрирован. Номер читательского билета: {new_id}",
-        user=created_user
+        user=public_user(created_user)
     )
 
 # Все читатели.
 @app.get('/readers', response_model=List[User])
-def get_all_readers():
-    users_data = load_json(USERS_FILE)
-    return [User(**u) for u in users_data if u.get('role') == 'Читатель']
+def get_all_readers(request: Request, params: PageParams = Depends(), session: Session = Depends(staff_session)):
+    return cached_response(request, [repository.readers], lambda: page_response(repository.readers, params, lambda u: u.role == 'Читатель'))
+
+# Поиск читателей.
+@app.get('/readers/search', response_model=List[User])
+def search_readers(
+    q: str,
+    session: Session = Depends(staff_session),
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    fields: Optional[str] = None,
+):
+    return search_response(repository.readers, q, limit, offset, fields, lambda u: u.role == 'Читатель')
 
 # Все книги.
 @app.get('/books', response_model=List[Book])
-def get_all_books():
-    books_data = load_json(BOOKS_FILE)
-    return [Book(**b) for b in books_data]
+def get_all_books(request: Request, params: PageParams = Depends(), session: Session = Depends(current_session)):
+    return cached_response(request, [repository.books], lambda: page_response(repository.books, params))
+
+# Поиск книг.
+@app.get('/books/search', response_model=List[Book])
+def search_books(
+    q: str,
+    session: Session = Depends(current_session),
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    fields: Optional[str] = None,
+):
+    return search_response(repository.books, q, limit, offset, fields)
 
 # Добавление книги.
 @app.post('/books/add', response_model=Response)
-def add_book(new_book_data: Book):
-    books_data = load_json(BOOKS_FILE)
-
-    for b in books_data:
-        if b.get('code') == new_book_data.code:
+def add_book(new_book_data: Book, session: Session = Depends(staff_session)):
+    with repository.books.writing():
+        if repository.books.find('code', new_book_data.code):
             return Response(success=False, message=f'Книга с кодом {new_book_data.code} уже существует.')
 
-    books_data.append(new_book_data.dict())
-    save_json(BOOKS_FILE, books_data)
+        repository.books.insert(new_book_data)
 
     return Response(success=True, message='Книга успешно добавлена в систему.')
 
 # Все книги доступные для оформления.
 @app.get('/books/available', response_model=List[Book])
-def get_available_books():
-    books_data = load_json(BOOKS_FILE)
-    tickets_data = load_json(TICKETS_FILE)
+def get_available_books(request: Request, params: PageParams = Depends(), session: Session = Depends(current_session)):
+    issued = repository.tickets.index('issued')
+    return cached_response(
+        request,
+        [repository.books, repository.tickets],
+        lambda: page_response(repository.books, params, lambda b: b.code not in issued)
+    )
 
-    busy_codes = set()
-    for t in tickets_data:
-        for code in t.get('books', []):
-            busy_codes.add(code)
+# Проверка дат нового билета; поля возврата задаёт только сервер.
+def new_ticket(ticket):
+    for value in (ticket.date_issue, ticket.date_return):
+        try:
+            parse_date(value)
+        except ValueError:
+            raise ValueError(f'Некорректная дата {value}, ожидается дд.мм.гггг')
+    return ReaderTicket(**{**ticket.dict(), 'id': None, 'returned': [], 'closed': False, 'date_closed': None})
 
-    available = [Book(**b) for b in books_data if b['code'] not in busy_codes]
-    return available
+# Отмечает книги билета возвращёнными; билет закрывается, когда на руках ничего не осталось.
+def return_books(ticket, codes):
+    returned = ticket.returned + [code for code in ticket.books if code in codes and code not in ticket.returned]
+    closed = all(code in returned for code in ticket.books)
+    return ReaderTicket(**{
+        **ticket.dict(),
+        'returned': returned,
+        'closed': closed,
+        'date_closed': format_date(date.today()) if closed else None,
+    })
 
 # Создать чит. дневник.
 @app.post('/tickets/create', response_model=Response)
-def create_ticket(ticket: ReaderTicket):
-    tickets_data = load_json(TICKETS_FILE)
-    books_data = load_json(BOOKS_FILE)
-    users_data = load_json(USERS_FILE)
-
-    reader_exists = False
-    for user in users_data:
-        if user.get('card_number') == ticket.reader_card_number:
-            reader_exists = True
-            break
-
-    if not reader_exists:
+def create_ticket(ticket: ReaderTicket, session: Session = Depends(staff_session)):
+    try:
+        ticket = new_ticket(ticket)
+    except ValueError as exception:
+        return Response(success=False, message=str(exception))
+
+    if not repository.readers.find('card_number', ticket.reader_card_number):
         return Response(success=False, message="Пользователь с таким номером читательского билета не найден")
 
-    all_book_codes = {b['code'] for b in books_data}
     for code in ticket.books:
-        if code not in all_book_codes:
+        if not repository.books.find('code', code):
             return Response(success=False, message=f"Книга с кодом {code} не существует в библиотеке")
 
-    busy_codes = set()
-    for t in tickets_data:
-        for code in t.get('books', []):
-            busy_codes.add(code)
-
-    for code in ticket.books:
-        if code in busy_codes:
-            return Response(success=False, message=f"Книга с кодом {code} уже выдана другому читателю")
+    # Проверка занятости и выдача под одной блокировкой, иначе книгу можно выдать дважды.
+    with repository.tickets.writing():
+        issued = repository.tickets.index('issued')
+        for code in ticket.books:
+            if code in issued:
+                return Response(success=False, message=f"Книга с кодом {code} уже выдана другому читателю")
 
-    tickets_data.append(ticket.dict())
-    save_json(TICKETS_FILE, tickets_data)
+        repository.tickets.insert(ticket)
 
     return Response(success=True, message="Читательский билет успешно оформлен")
 
 # Вернуть список книг по чит. дневнику.
 @app.get('/tickets/{card_number}/books', response_model=List[Book])
-def get_reader_issued_books(card_number: int):
-    tickets_data = load_json(TICKETS_FILE)
-    books_data = load_json(BOOKS_FILE)
+def get_reader_issued_books(request: Request, card_number: int, session: Session = Depends(current_session)):
+    # Читатель видит только свои книги.
+    if session.role != 'Администратор' and session.card_number != card_number:
+        raise HTTPException(status_code=403, detail='Недостаточно прав')
+
+    loans = repository.tickets.index('loans')
+
+    def build():
+        books = repository.books.index('code')
+        reader_books = [book for book in (books.get(code) for code in loans.get(card_number)) if book]
+        return EncodedListResponse(repository.books.encode_many(reader_books))
+
+    return cached_response(request, [repository.books], build, versions=[loans.version(card_number)])
+
+# История читателя: сначала билеты рабочего набора, затем архив от новых сегментов к старым.
+# Архив распаковывается лениво: только сегменты с билетами читателя и только пока не набран limit.
+@app.get('/readers/{card_number}/history', response_model=List[ReaderTicket])
+def get_reader_history(card_number: int, limit: int = Query(100, ge=1, le=1000), session: Session = Depends(current_session)):
+    if session.role != 'Администратор' and session.card_number != card_number:
+        raise HTTPException(status_code=403, detail='Недостаточно прав')
+
+    hot = sorted(repository.tickets.find('reader_card_number', card_number), key=lambda t: t.id or 0, reverse=True)
+    tickets = itertools.islice(itertools.chain(hot, repository.archive.history(card_number)), limit)
+    return JSONResponse(content=[ticket.dict() for ticket in tickets])
+
+# Возврат книги: книга освобождается, билет закрывается после возврата последней книги.
+@app.post('/books/{code}/return', response_model=Response)
+def return_book(code: str, session: Session = Depends(staff_session)):
+    with repository.tickets.writing():
+        ticket = repository.tickets.find('issued', code)
+        if ticket is None:
+            return Response(success=False, message=f"Книга с кодом {code} не числится выданной")
+        repository.tickets.update(ticket, return_books(ticket, {code}))
+
+    return Response(success=True, message="Книга возвращена")
+
+# Закрыть чит. дневник: все его книги считаются возвращёнными.
+@app.post('/tickets/{ticket_id}/close', response_model=Response)
+def close_ticket(ticket_id: int, session: Session = Depends(staff_session)):
+    with repository.tickets.writing():
+        ticket = repository.tickets.find('id', ticket_id)
+        if ticket is None:
+            return Response(success=False, message="Читательский дневник не найден")
+        if ticket.closed:
+            return Response(success=False, message="Читательский дневник уже закрыт")
+        repository.tickets.update(ticket, return_books(ticket, set(ticket.books)))
+
+    return Response(success=True, message="Читательский дневник закрыт")
+
+# Просроченные билеты: срок возврата раньше сегодняшнего дня, самые давние первыми.
+@app.get('/tickets/overdue', response_model=List[ReaderTicket])
+def get_overdue_tickets(session: Session = Depends(staff_session)):
+    due = repository.tickets.index('due')
+    return JSONResponse(content=[ticket.dict() for ticket in due.range(high=(date.today(),))])
+
+# Билеты со сроком возврата в ближайшие days дней, начиная с сегодняшнего (по умолчанию неделя).
+@app.get('/tickets/due', response_model=List[ReaderTicket])
+def get_due_tickets(days: int = Query(7, ge=1, le=366), session: Session = Depends(staff_session)):
+    today = date.today()
+    due = repository.tickets.index('due')
+    return JSONResponse(content=[ticket.dict() for ticket in due.range((today,), (today + timedelta(days=days),))])
+
+# ===
+# Массовый импорт
+# ===
+
+# Строки тела запроса: JSON-массив или NDJSON (по строке на запись).
+# Возвращает пары (номер строки, запись); нечитаемая строка NDJSON даёт ValueError вместо записи.
+async def read_bulk_rows(request: Request):
+    body = await request.body()
+
+    if 'ndjson' in request.headers.get('content-type', ''):
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail='Тело запроса должно быть в кодировке UTF-8')
+        rows = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append((number, json.loads(line)))
+            except ValueError:
+                rows.append((number, ValueError('Некорректная строка JSON')))
+        return rows
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Тело запроса должно быть JSON-массивом или NDJSON')
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail='Тело запроса должно быть JSON-массивом или NDJSON')
+    return list(enumerate(data, 1))
+
+def error_message(exception):
+    if isinstance(exception, ValidationError):
+        return '; '.join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exception.errors())
+    return str(exception)
+
+# Проверяет все строки за один проход (parse и prepare бросают ValueError с причиной отказа)
+# и сохраняет прошедшие проверку записи одной записью в хранилище. parse не зависит
+# от данных коллекции и выполняется до блокировки; prepare - под блокировкой.
+def bulk_insert(collection, rows, prepare, parse=None):
+    errors = []
+    items = []
+
+    parsed = []
+    for number, row in rows:
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if not isinstance(row, dict):
+                raise ValueError('Запись должна быть JSON-объектом')
+            parsed.append((number, parse(row) if parse else row))
+        except ValueError as exception:
+            errors.append(BulkError(row=number, message=error_message(exception)))
+
+    with collection.writing():
+        context = {}
+        for number, row in parsed:
+            try:
+                items.append(prepare(row, context))
+            except ValueError as exception:
+                errors.append(BulkError(row=number, message=error_message(exception)))
 
-    reader_book_codes = set()
-    for t in tickets_data:
-        if t.get('reader_card_number') == card_number:
-            for code in t.get('books', []):
-                reader_book_codes.add(code)
+        if items:
+            collection.insert_many(items)
 
-    reader_books = [Book(**b) for b in books_data if b['code'] in reader_book_codes]
+    errors.sort(key=lambda error: error.row)
 
-    return reader_books
+    return BulkResponse(
+        success=not errors,
+        message=f'Добавлено записей: {len(items)}, отклонено: {len(errors)}.',
+        inserted=len(items),
+        errors=errors
+    )
+
+def prepare_book(row, context):
+    book = Book(**row)
+    seen = context.setdefault('codes', set())
+    if book.code in seen or repository.books.find('code', book.code):
+        raise ValueError(f'Книга с кодом {book.code} уже существует.')
+    seen.add(book.code)
+    return book
+
+# Проверка полей и хеширование пароля - до блокировки коллекции.
+def parse_reader(row):
+    user_dict = UserRegister(**row).dict()
+    if user_dict.get('password'):
+        user_dict['password'] = hash_password(user_dict['password'])
+    return user_dict
+
+def prepare_reader(user_dict, context):
+    phones = context.setdefault('phones', set())
+    logins = context.setdefault('logins', set())
+    phone, login = user_dict['phone'], user_dict.get('login')
+    if phone in phones or repository.readers.find('phone', phone):
+        raise ValueError('Пользователь с таким номером телефона уже существует')
+    if login is not None and (login in logins or repository.readers.find('login', login)):
+        raise ValueError('Пользователь с таким логином уже существует')
+    # Телефон и логин занимаются, только если строка принята целиком.
+    phones.add(phone)
+    if login is not None:
+        logins.add(login)
+
+    if 'next_card_number' not in context:
+        context['next_card_number'] = repository.readers.next_key()
+    user_dict['card_number'] = context['next_card_number']
+    context['next_card_number'] += 1
+    return User(**user_dict)
+
+def prepare_ticket(row, context):
+    ticket = new_ticket(ReaderTicket(**row))
+    if not repository.readers.find('card_number', ticket.reader_card_number):
+        raise ValueError('Пользователь с таким номером читательского билета не найден')
+
+    issued = repository.tickets.index('issued')
+    seen = context.setdefault('codes', set())
+    for code in ticket.books:
+        if not repository.books.find('code', code):
+            raise ValueError(f'Книга с кодом {code} не существует в библиотеке')
+        if code in issued or code in seen:
+            raise ValueError(f'Книга с кодом {code} уже выдана другому читателю')
+    seen.update(ticket.books)
+    return ticket
+
+@app.post('/books/bulk', response_model=BulkResponse)
+async def bulk_add_books(request: Request, session: Session = Depends(staff_session)):
+    rows = await read_bulk_rows(request)
+    return await run_in_threadpool(bulk_insert, repository.books, rows, prepare_book)
+
+@app.post('/readers/bulk', response_model=BulkResponse)
+async def bulk_register_readers(request: Request, session: Session = Depends(staff_session)):
+    rows = await read_bulk_rows(request)
+    return await run_in_threadpool(bulk_insert, repository.readers, rows, prepare_reader, parse_reader)
+
+@app.post('/tickets/bulk', response_model=BulkResponse)
+async def bulk_create_tickets(request: Request, session: Session = Depends(staff_session)):
+    rows = await read_bulk_rows(request)
+    return await run_in_threadpool(bulk_insert, repository.tickets, rows, prepare_ticket)
+
+# ===
+# Выгрузка
+# ===
+
+# Записи коллекции построчно в NDJSON, порциями, без сборки всего ответа в памяти.
+# Запись без скрытых полей коллекции (хешей паролей) - для выгрузки и синхронизации.
+def public_row(collection, item):
+    return item.dict(exclude=collection.hidden)
+
+# Записи коллекции для выгрузки. У билетов за рабочим набором идут архивные сегменты,
+# от старых к новым; билет, уже попавший в архив, но ещё не убранный из рабочего набора
+# (перенос прерван), выгружается один раз.
+def export_rows(collection):
+    items = collection.all()
+    for item in items:
+        yield public_row(collection, item)
+
+    if collection is repository.tickets:
+        hot = {item.id for item in items}
+        for segment in repository.archive.segments():
+            for row in repository.archive.read(segment):
+                if row['id'] not in hot:
+                    yield row
+
+def ndjson_rows(rows, chunk_size=1000):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row, ensure_ascii=False))
+        if len(chunk) >= chunk_size:
+            yield ('\n'.join(chunk) + '\n').encode('utf-8')
+            chunk = []
+    if chunk:
+        yield ('\n'.join(chunk) + '\n').encode('utf-8')
+
+# Выгрузка коллекции (books, readers, tickets) для резервных копий и отчётов; tickets - вместе с архивом.
+@app.get('/export/{name}.ndjson')
+def export_collection(name: str, session: Session = Depends(staff_session)):
+    collection = repository.collections.get(name)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f'Коллекция {name} не найдена')
+    return StreamingResponse(
+        ndjson_rows(export_rows(collection)),
+        media_type='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{name}.ndjson"'}
+    )
+
+# ===
+# Синхронизация
+# ===
+
+# Изменения после курсора since: по каждой коллекции новые и изменённые записи целиком
+# (последнее состояние по ключу) и ключи удалённых. Без курсора, с устаревшим курсором
+# или после перезапуска сервера отдаётся полная выгрузка с reset=true.
+# Билеты - только рабочий набор: архивные закрыты и не меняются, они доступны
+# в /readers/{card_number}/history и в /export/tickets.ndjson.
+def sync_payload(since):
+    # Изменения в обход сервера сбрасывают журнал, поэтому сначала перечитываем данные.
+    for collection in repository.collections.values():
+        collection.refresh()
+
+    entries, cursor = repository.changes.since(since)
+    if entries is None:
+        # Курсор берём до чтения данных: изменение между ними придёт ещё раз в следующей дельте.
+        changes = {
+            name: {'upserted': [public_row(collection, item) for item in collection.all()], 'deleted': []}
+            for name, collection in repository.collections.items()
+        }
+        return {'cursor': cursor, 'reset': True, 'changes': changes}
+
+    latest = {name: {} for name in repository.collections}
+    for seq, name, op, item in entries:
+        collection = repository.collections[name]
+        latest[name][getattr(item, collection.key)] = (op, item)
+
+    changes = {}
+    for name, rows in latest.items():
+        collection = repository.collections[name]
+        changes[name] = {
+            'upserted': [public_row(collection, item) for op, item in rows.values() if op != 'delete'],
+            'deleted': [key for key, (op, item) in rows.items() if op == 'delete'],
+        }
+    return {'cursor': cursor, 'reset': False, 'changes': changes}
+
+@app.get('/sync')
+def sync(since: Optional[str] = None, session: Session = Depends(staff_session)):
+    return JSONResponse(content=sync_payload(since))
+
+# Раз в столько секунд без изменений поток событий шлёт комментарий, чтобы соединение не закрыли по простою.
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Событие SSE с изменениями после курсора (None, если изменений нет) и новый курсор.
+# Полная выгрузка может быть большой, поэтому и сборка, и сериализация идут в пуле потоков.
+def sync_event(cursor):
+    payload = sync_payload(cursor)
+    changed = any(delta['upserted'] or delta['deleted'] for delta in payload['changes'].values())
+    if not (payload['reset'] or changed):
+        return None, payload['cursor']
+    data = json.dumps(payload, ensure_ascii=False)
+    return f'event: changes\nid: {payload["cursor"]}\ndata: {data}\n\n'.encode('utf-8'), payload['cursor']
+
+# Поток событий (SSE): после каждой записи клиент получает событие changes в формате /sync.
+async def event_stream(request, since):
+    subscriber = repository.changes.subscribe()
+    event = subscriber[1]
+    try:
+        cursor = since
+        while True:
+            event.clear()
+            message, cursor = await run_in_threadpool(sync_event, cursor)
+            if message is not None:
+                yield message
+
+            while not event.is_set():
+                if await request.is_disconnected():
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+    finally:
+        repository.changes.unsubscribe(subscriber)
+
+# Подписка на изменения. Курсор передаётся в since или заголовком Last-Event-ID при переподключении;
+# без курсора первым событием приходит полная выгрузка.
+@app.get('/events')
+async def events(
+    request: Request,
+    since: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+    session: Session = Depends(staff_session)
+):
+    if since is None and last_event_id:
+        since = last_event_id
+    return StreamingResponse(
+        event_stream(request, since),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 # ======
 # Запуск сервера
@@ -326,4 +2294,43 @@ async def startup():
     print('Запуск сервера..\nПроверка данных системы..\n')
     create_default_books()
     create_default_users()
-    create_default_tickets()
\ No newline at end of file
+    create_default_tickets()
+    repository.load()
+    if ARCHIVE_INTERVAL > 0:
+        asyncio.create_task(archive_periodically())
+
+# ======
+# Миграции
+# Команда: python server.py migrate-sqlite [путь к базе]
+# Команда: python server.py hash-passwords
+# Команда: python server.py archive-tickets
+# ======
+
+# Замена паролей в открытом виде на хеши во всех записях читателей.
+def migrate_passwords():
+    repository.load()
+    with repository.readers.writing():
+        replacements = [
+            (user, User(**{**user.dict(), 'password': hash_password(user.password)}))
+            for user in repository.readers.all()
+            if user.password and not is_password_hash(user.password)
+        ]
+        if replacements:
+            repository.readers.update_many(replacements)
+    print(f'Пароли переведены в хеши: {len(replacements)}.')
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'migrate-sqlite':
+        target = sys.argv[2] if len(sys.argv) >= 3 else SQLITE_FILE
+        # Новая база заполняется при создании (до уникальных индексов), в существующую дописываем пустые таблицы.
+        is_new = not os.path.exists(target)
+        backend = SqliteBackend(target, FILES_DIR)
+        if not is_new:
+            import_json_to_sqlite(backend, FILES_DIR)
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'hash-passwords':
+        migrate_passwords()
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'archive-tickets':
+        repository.load()
+        print(f'В архив перенесено билетов: {archive_closed_tickets()}.')
+    else:
+        print('Использование: python server.py migrate-sqlite [путь к базе] | hash-passwords | archive-tickets')
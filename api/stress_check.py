@@ -0,0 +1,99 @@
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# ======
+# Проверка одновременных записей
+# Команда: python stress_check.py [потоков] [книг]
+# Сервер запускается на копии данных во временном каталоге, рабочие файлы не меняются.
+# ======
+
+ADMIN_LOGIN = os.environ.get('LIBRARY_STRESS_LOGIN', 'aorayden')
+ADMIN_PASSWORD = os.environ.get('LIBRARY_STRESS_PASSWORD', '*<i51V7CEkgS')
+
+def load_server_copy():
+    source = os.path.dirname(os.path.abspath(__file__))
+    target = tempfile.mkdtemp(prefix='library-stress-')
+    for name in ('server.py', 'books.json', 'readers.json', 'tickets.json'):
+        if os.path.exists(os.path.join(source, name)):
+            shutil.copy(os.path.join(source, name), target)
+    os.environ['LIBRARY_ARCHIVE_INTERVAL'] = '0'
+    os.environ.setdefault('LIBRARY_SQLITE_FILE', os.path.join(target, 'library.db'))
+    sys.path.insert(0, target)
+    import server
+    return server, target
+
+def main():
+    from fastapi.testclient import TestClient
+
+    threads = int(sys.argv[1]) if len(sys.argv) >= 2 else 32
+    book_count = int(sys.argv[2]) if len(sys.argv) >= 3 else 50
+    server, target = load_server_copy()
+
+    try:
+        with TestClient(server.app) as client:
+            response = client.post('/auth/login', json={'login': ADMIN_LOGIN, 'password': ADMIN_PASSWORD}).json()
+            if not response['success']:
+                print(f'Не удалось войти: {response["message"]}')
+                return 1
+            headers = {'Authorization': f'Bearer {response["token"]}'}
+            reader = client.get('/readers', headers=headers).json()[0]['card_number']
+
+            codes = [f'STRESS-{number}' for number in range(book_count)]
+            for code in codes:
+                client.post('/books/add', headers=headers, json={
+                    'code': code, 'author': 'Стресс', 'name': 'Проверка',
+                    'year_publication': 2000, 'sign_novelty_and_annotations': ''
+                })
+
+            # Каждую книгу пытаются выдать несколько потоков сразу: успешной должна быть ровно одна выдача.
+            def issue(attempt):
+                return client.post('/tickets/create', headers=headers, json={
+                    'reader_card_number': reader, 'books': [codes[attempt % book_count]],
+                    'date_issue': '01.01.2026', 'date_return': '01.02.2026'
+                }).json()['success']
+
+            def register(attempt):
+                return client.post('/auth/register', headers=headers, json={
+                    'surname': 'Стресс', 'name': 'Проверка', 'patronymic': str(attempt),
+                    'address': '-', 'phone': f'+7-000-{attempt:06d}'
+                }).json()['user']['card_number']
+
+            with ThreadPoolExecutor(threads) as executor:
+                issued = sum(executor.map(issue, range(book_count * 8)))
+                cards = list(executor.map(register, range(book_count * 4)))
+
+            # Перечитываем сохранённые данные: в хранилище не должно оказаться лишних записей.
+            server.repository.load()
+            stress_codes = set(codes)
+            per_code = Counter(
+                code for ticket in server.repository.tickets.all()
+                for code in ticket.books if code in stress_codes
+            )
+            card_counts = Counter(user.card_number for user in server.repository.readers.all())
+    finally:
+        shutil.rmtree(target, ignore_errors=True)
+
+    failures = []
+    if issued != book_count:
+        failures.append(f'успешных выдач {issued}, ожидалось {book_count}')
+    doubles = sorted(code for code, count in per_code.items() if count > 1)
+    if doubles:
+        failures.append(f'книги выданы дважды: {", ".join(doubles)}')
+    if len(set(cards)) != len(cards):
+        failures.append('при регистрации выданы повторяющиеся номера билетов')
+    repeated = sorted(card for card, count in card_counts.items() if count > 1)
+    if repeated:
+        failures.append(f'повторяющиеся номера билетов в хранилище: {repeated}')
+
+    if failures:
+        print('Проверка не пройдена:\n' + '\n'.join(failures))
+        return 1
+    print(f'Проверка пройдена: {threads} потоков, {issued} выдач без повторов, {len(cards)} уникальных номеров билетов.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,111 @@
+import os
 import sys
 import httpx
 import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from PyQt6.QtCore import Qt, pyqtSlot, QDate
+from PyQt6.QtCore import Qt, pyqtSlot, QDate, QTimer, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
 from PyQt6.QtGui import QFont
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QLabel, QLineEdit,
                              QPushButton, QMessageBox, QMainWindow, QHBoxLayout,
-                             QTableWidget, QHeaderView, QAbstractItemView, QFormLayout, QFrame, QSpinBox, QDateEdit)
+                             QTableView, QHeaderView, QAbstractItemView, QFormLayout, QFrame, QSpinBox, QDateEdit)
 from qasync import QEventLoop
 
+# Локальная копия данных между запусками (переопределяется переменной окружения LIBRARY_CACHE).
+# В ней лежат данные читателей, поэтому при выходе из учётной записи копия этой учётной записи
+# стирается; при закрытии окна без выхода она остаётся. Удалить все копии вручную: удалить
+# файл вместе с файлами -wal и -shm рядом с ним (~/.library/cache.sqlite3* по умолчанию).
+CACHE_PATH = os.environ.get('LIBRARY_CACHE', os.path.join(os.path.expanduser('~'), '.library', 'cache.sqlite3'))
+
+# ======
+# Локальный кеш
+# ======
+
+# Копия данных сервера в SQLite: записи коллекций и курсор /sync, на котором они сняты.
+# scope - адрес сервера и логин, чтобы копии разных серверов и сотрудников не смешивались.
+# Дельты пишутся построчно, поэтому сохранение события стоит столько же, сколько его размер.
+class ReplicaCache:
+    def __init__(self, path, scope):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.scope = scope
+        # Запись идёт в отдельном потоке по очереди: полный снимок на сотню тысяч записей
+        # не подвешивает интерфейс, а дельты ложатся в базу в порядке прихода.
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.connection.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA secure_delete = ON;
+            CREATE TABLE IF NOT EXISTS records (
+                scope TEXT, collection TEXT, key TEXT, data TEXT,
+                PRIMARY KEY (scope, collection, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS cursors (scope TEXT PRIMARY KEY, cursor TEXT);
+        ''')
+
+    # Копия и её курсор; без сохранённого курсора копии нет. Записи коллекции склеиваются
+    # в один JSON-массив прямо в SQLite: один разбор вдвое быстрее разбора по строке.
+    def load(self, keys):
+        replica = {name: {} for name in keys}
+        row = self.connection.execute('SELECT cursor FROM cursors WHERE scope = ?', (self.scope,)).fetchone()
+        if row is None:
+            return replica, None
+        for collection, data in self.connection.execute(
+                "SELECT collection, '[' || group_concat(data, ',') || ']' FROM records WHERE scope = ? GROUP BY collection",
+                (self.scope,)):
+            if collection in replica:
+                key = keys[collection]
+                replica[collection] = {record[key]: record for record in json.loads(data)}
+        return replica, row[0]
+
+    # Изменения /sync в том же виде, в каком они применяются к копии в памяти.
+    def save(self, data, keys):
+        self.writer.submit(self.write, data, keys)
+
+    def write(self, data, keys):
+        try:
+            self.write_changes(data, keys)
+        except sqlite3.Error as exception:
+            print(f'Не удалось сохранить локальный кеш: {exception}')
+
+    def write_changes(self, data, keys):
+        with self.connection:
+            if data['reset']:
+                self.connection.execute('DELETE FROM records WHERE scope = ?', (self.scope,))
+            for name, delta in data['changes'].items():
+                key = keys[name]
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)',
+                    [(self.scope, name, str(row[key]), json.dumps(row, ensure_ascii=False)) for row in delta['upserted']]
+                )
+                self.connection.executemany(
+                    'DELETE FROM records WHERE scope = ? AND collection = ? AND key = ?',
+                    [(self.scope, name, str(deleted)) for deleted in delta['deleted']]
+                )
+            self.connection.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (self.scope, data['cursor']))
+
+    # Стирание копии при выходе: встаёт в очередь после ещё не записанных изменений.
+    # secure_delete затирает удалённые страницы, а сброс WAL убирает их старые версии из журнала.
+    def purge(self):
+        self.writer.submit(self.delete_scope)
+
+    def delete_scope(self):
+        try:
+            with self.connection:
+                self.connection.execute('DELETE FROM records WHERE scope = ?', (self.scope,))
+                self.connection.execute('DELETE FROM cursors WHERE scope = ?', (self.scope,))
+            self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.Error as exception:
+            print(f'Не удалось очистить локальный кеш: {exception}')
+
+    # Закрытие встаёт в очередь за ещё не записанными изменениями.
+    def close(self):
+        self.writer.submit(self.connection.close)
+        self.writer.shutdown(wait=False)
+
 # ======
 # API сервис
 # ======
@@ -21,6 +118,20 @@ class APIService:
             cls._instance = super(APIService, cls).__new__(cls, *args, **kwargs)
             cls._instance.client = None
             cls._instance.base_url = 'http://127.0.0.1:5079'
+            cls._instance.token = None
+            # Последние ответы GET с их ETag: (endpoint, параметры) -> (etag, данные).
+            cls._instance.etag_cache = {}
+            # Локальная копия данных сервера, обновляемая дельтами /sync: коллекция -> {ключ: запись}.
+            cls._instance.replica = {'books': {}, 'readers': {}, 'tickets': {}}
+            cls._instance.cursor = None
+            # Обработчики изменений реплики (окна) и задача подписки на события сервера.
+            cls._instance.listeners = []
+            cls._instance.events_task = None
+            # Выполняющиеся запросы: одинаковые одновременные запросы ждут одну задачу.
+            cls._instance.inflight = {}
+            # Время ответа по адресам: endpoint -> {'requests', 'shared', 'total', 'max'} (секунды).
+            cls._instance.timings = {}
+            cls._instance.cache = None
         return cls._instance
 
     # ===
@@ -38,51 +149,493 @@ class APIService:
     # ===
     # Базовые функции (GET / POST)
     # ===
+    def auth_headers(self):
+        return {'Authorization': f'Bearer {self.token}'} if self.token else {}
+
+    # Одинаковый запрос (key), уже идущий в этот момент, не повторяется: вызывающий ждёт
+    # ту же задачу. shield - отмена одного из ожидающих не обрывает запрос для остальных.
+    async def coalesce(self, key, factory):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self.inflight.pop(key) if self.inflight.get(key) is done else None)
+        else:
+            self.timing(key[0])['shared'] += 1
+        return await asyncio.shield(task)
+
+    def timing(self, endpoint):
+        return self.timings.setdefault(endpoint, {'requests': 0, 'shared': 0, 'total': 0.0, 'max': 0.0})
+
+    def record_timing(self, endpoint, elapsed):
+        timing = self.timing(endpoint)
+        timing['requests'] += 1
+        timing['total'] += elapsed
+        timing['max'] = max(timing['max'], elapsed)
+
+    # Сводка по адресам: число запросов, сколько вызовов получили чужой результат, среднее и худшее время (мс).
+    def timings_report(self):
+        return {
+            endpoint: {
+                'requests': timing['requests'],
+                'shared': timing['shared'],
+                'avg_ms': round(timing['total'] * 1000 / timing['requests'], 1) if timing['requests'] else 0.0,
+                'max_ms': round(timing['max'] * 1000, 1),
+            }
+            for endpoint, timing in self.timings.items()
+        }
+
     async def _get(self, endpoint, params=None):
+        key = (endpoint, tuple(sorted((params or {}).items())))
+        data = await self.coalesce(key, lambda: self.fetch(endpoint, params, key))
+        return list(data) if isinstance(data, list) else data
+
+    async def fetch(self, endpoint, params, key):
         if not self.client:
             await self.init_session()
+
+        cached = self.etag_cache.get(key)
+        headers = self.auth_headers()
+        if cached:
+            headers['If-None-Match'] = cached[0]
+
+        started = time.perf_counter()
         try:
-            response = await self.client.get(endpoint, params=params)
-            return response.json()
+            response = await self.client.get(endpoint, params=params, headers=headers)
+            # Данные не менялись: сервер ответил 304 без тела.
+            if response.status_code == 304 and cached:
+                return cached[1]
+
+            data = response.json()
+            etag = response.headers.get('ETag')
+            if response.status_code == 200 and etag:
+                self.etag_cache[key] = (etag, data)
+            return data
         except Exception:
             return []
+        finally:
+            self.record_timing(endpoint, time.perf_counter() - started)
 
     async def _post(self, endpoint, payload):
         if not self.client:
             await self.init_session()
+        started = time.perf_counter()
         try:
-            response = await self.client.post(endpoint, json=payload)
+            response = await self.client.post(endpoint, json=payload, headers=self.auth_headers())
             return response.json()
         except Exception as exception:
             return {'success': False, 'message': str(exception)}
+        finally:
+            self.record_timing(endpoint, time.perf_counter() - started)
 
     # ===
     # Запросы
     # ===
 
     async def login(self, login, password):
-        return await self._post('auth/login', {'login': login, 'password': password})
-
-    async def get_all_readers(self):
-        return await self._get('readers')
+        result = await self._post('auth/login', {'login': login, 'password': password})
+        if result.get('success'):
+            self.token = result.get('token')
+            self.open_cache(login)
+        return result
+
+    async def logout(self):
+        self.stop_events()
+        if self.token:
+            await self._post('auth/logout', {})
+            self.token = None
+        self.etag_cache.clear()
+        self.replica = {'books': {}, 'readers': {}, 'tickets': {}}
+        self.cursor = None
+        if self.cache is not None:
+            self.cache.purge()
+            self.cache.close()
+            self.cache = None
+
+    async def get_all_readers(self, params=None):
+        return await self._get('readers', params)
+
+    async def search_readers(self, query, params=None):
+        return await self._get('readers/search', {'q': query, **(params or {})})
 
     async def register_user(self, payload):
         return await self._post('auth/register', payload)
 
-    async def get_all_books(self):
-        return await self._get('books')
+    async def get_all_books(self, params=None):
+        return await self._get('books', params)
+
+    async def search_books(self, query, params=None):
+        return await self._get('books/search', {'q': query, **(params or {})})
 
     async def add_book(self, payload):
         return await self._post('books/add', payload)
 
-    async def get_available_books(self):
-        return await self._get('books/available')
+    async def get_available_books(self, params=None):
+        return await self._get('books/available', params)
 
     async def create_ticket(self, payload):
         return await self._post('tickets/create', payload)
 
+    # ===
+    # Синхронизация
+    # ===
+    REPLICA_KEYS = {'books': 'code', 'readers': 'card_number', 'tickets': 'id'}
+
+    # Забирает изменения после последнего курсора и применяет их к локальной копии.
+    # Возвращает False, если сервер недоступен или отказал. Окна, открытые одновременно,
+    # ждут одну синхронизацию, и изменения применяются один раз.
+    async def sync(self):
+        return await self.coalesce(('sync',), self.pull_changes)
+
+    # Копия с прошлого запуска: окна показывают её сразу, а /sync с её курсора досылает только
+    # изменения (или полный набор, если сервер перезапущен и курсор ему неизвестен).
+    def open_cache(self, login):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        try:
+            self.cache = ReplicaCache(CACHE_PATH, f'{self.base_url} {login}')
+            self.replica, self.cursor = self.cache.load(self.REPLICA_KEYS)
+        except (sqlite3.Error, OSError, ValueError) as exception:
+            print(f'Локальный кеш недоступен: {exception}')
+            self.cache = None
+
+    async def pull_changes(self):
+        data = await self._get('sync', {'since': self.cursor} if self.cursor is not None else None)
+        if not isinstance(data, dict) or 'cursor' not in data:
+            return False
+        self.apply_changes(data)
+        return True
+
+    # Курсор сервера - "запуск.номер"; номера сравнимы только внутри одного запуска.
+    def is_stale(self, cursor):
+        if self.cursor is None:
+            return False
+        epoch, _, number = str(cursor).rpartition('.')
+        current_epoch, _, current_number = str(self.cursor).rpartition('.')
+        return epoch == current_epoch and number.isdigit() and current_number.isdigit() and int(number) <= int(current_number)
+
+    # /sync и /events могут прислать одни и те же изменения: дельта с курсором не новее
+    # текущего уже применена и пропускается (полная выгрузка применяется всегда).
+    def apply_changes(self, data):
+        if not data['reset'] and self.is_stale(data['cursor']):
+            return
+        if data['reset']:
+            self.replica = {name: {} for name in self.REPLICA_KEYS}
+        for name, delta in data['changes'].items():
+            rows = self.replica.setdefault(name, {})
+            key = self.REPLICA_KEYS[name]
+            for row in delta['upserted']:
+                rows[row[key]] = row
+            for deleted in delta['deleted']:
+                rows.pop(deleted, None)
+        self.cursor = data['cursor']
+
+        if self.cache is not None:
+            self.cache.save(data, self.REPLICA_KEYS)
+
+        for listener in list(self.listeners):
+            try:
+                listener(data)
+            except Exception as exception:
+                print(f'Ошибка обработчика изменений: {exception}')
+
+    # Подписка на поток событий /events; при обрыве переподключается со своего курсора.
+    def start_events(self):
+        if self.events_task is None or self.events_task.done():
+            self.events_task = asyncio.create_task(self.listen_events())
+
+    def stop_events(self):
+        if self.events_task is not None:
+            self.events_task.cancel()
+            self.events_task = None
+
+    # Без курсора /events начал бы с полной выгрузки, которую окна и так запрашивают через /sync
+    # при открытии, поэтому подписка ждёт эту синхронизацию и продолжает с её курсора.
+    async def listen_events(self):
+        while self.token:
+            if not self.client:
+                await self.init_session()
+            if self.cursor is None and not await self.sync():
+                await asyncio.sleep(3)
+                continue
+            params = {'since': self.cursor}
+            try:
+                async with self.client.stream('GET', 'events', params=params, headers=self.auth_headers(),
+                                              timeout=httpx.Timeout(10.0, read=None)) as response:
+                    if response.status_code != 200:
+                        return
+                    data_lines = []
+                    async for line in response.aiter_lines():
+                        if line.startswith('data:'):
+                            data_lines.append(line[5:].lstrip())
+                        elif not line and data_lines:
+                            self.apply_changes(json.loads('\n'.join(data_lines)))
+                            data_lines = []
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+            await asyncio.sleep(3)
+
+    def replica_books(self):
+        return list(self.replica['books'].values())
+
+    def replica_readers(self):
+        return [reader for reader in self.replica['readers'].values() if reader.get('role') == 'Читатель']
+
+    def replica_available_books(self):
+        issued = {
+            code
+            for ticket in self.replica['tickets'].values() if not ticket.get('closed')
+            for code in ticket.get('books', []) if code not in ticket.get('returned', [])
+        }
+        return [book for book in self.replica['books'].values() if book['code'] not in issued]
+
 api_service = APIService()
 
+# ======
+# Модели таблиц
+# ======
+
+# Пауза в наборе текста, после которой пересчитывается фильтр таблицы (мс).
+FILTER_DELAY_MS = 250
+# Начиная с такого числа записей поиск в окнах книг и читателей отдаётся серверу.
+SERVER_SEARCH_MIN_ROWS = 200_000
+SERVER_SEARCH_LIMIT = 1000
+
+# Строка для поиска без учёта регистра (ё и е не различаем, как normalize_text на сервере).
+def search_key(value):
+    return str(value).casefold().replace('ё', 'е')
+
+# Таймер, откладывающий slot до паузы в наборе: фильтр считается один раз, а не на каждую букву.
+def debounce(parent, slot, interval=FILTER_DELAY_MS):
+    timer = QTimer(parent)
+    timer.setSingleShot(True)
+    timer.setInterval(interval)
+    timer.timeout.connect(slot)
+    return timer
+
+# Таблица над списком записей (словарей). Ячейки отдаются представлению по запросу,
+# поэтому рисуются только видимые строки и на ячейки не создаются виджеты.
+# columns - [(заголовок, поле)], key - поле-ключ записи, search_fields - поля для поиска:
+# их нормализованная строка считается один раз при загрузке записи, а не на каждый фильтр.
+class RecordsModel(QAbstractTableModel):
+    RecordRole = Qt.ItemDataRole.UserRole
+    SortRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, columns, key, search_fields=(), parent=None):
+        super().__init__(parent)
+        self.columns = columns
+        self.key = key
+        self.search_fields = search_fields
+        self.rows = []
+        self.positions = {}
+        self.search_keys = {}
+        # Фильтры над моделью узнают об изменённых записях до того, как их увидит представление.
+        self.filters = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            value = record.get(self.columns[index.column()][1])
+            return '' if value is None else str(value)
+        if role == self.SortRole:
+            value = record.get(self.columns[index.column()][1])
+            return '' if value is None else value
+        if role == self.RecordRole:
+            return record
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.columns[section][0]
+        return None
+
+    def records(self):
+        return list(self.rows)
+
+    # Поля разделены переводом строки, чтобы запрос не совпадал со стыком двух полей.
+    def search_text(self, record):
+        return search_key('\n'.join([str(record.get(field) or '') for field in self.search_fields]))
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.reindex()
+        self.search_keys = {record[self.key]: self.search_text(record) for record in self.rows}
+        for proxy in self.filters:
+            proxy.refilter()
+        self.endResetModel()
+
+    def reindex(self):
+        self.positions = {record[self.key]: position for position, record in enumerate(self.rows)}
+
+    # Изменённые записи обновляются на месте, новые добавляются в конец.
+    def upsert(self, records):
+        records = [record for record in records if self.get(record[self.key]) is not record]
+        if not records:
+            return
+        for record in records:
+            self.search_keys[record[self.key]] = self.search_text(record)
+        for proxy in self.filters:
+            proxy.records_changed(records)
+
+        appended = {}
+        for record in records:
+            position = self.positions.get(record[self.key])
+            if position is None:
+                appended[record[self.key]] = record
+            else:
+                self.rows[position] = record
+                self.dataChanged.emit(self.index(position, 0), self.index(position, len(self.columns) - 1))
+
+        if appended:
+            start = len(self.rows)
+            self.beginInsertRows(QModelIndex(), start, start + len(appended) - 1)
+            for key, record in appended.items():
+                self.positions[key] = len(self.rows)
+                self.rows.append(record)
+            self.endInsertRows()
+
+    def get(self, key):
+        position = self.positions.get(key)
+        return None if position is None else self.rows[position]
+
+    # Записи с этими ключами изменились вне модели (например, условие фильтра окна): фильтры
+    # пересчитывают только их, а представления получают dataChanged по сплошным диапазонам строк.
+    def refresh(self, keys):
+        positions = sorted(self.positions[key] for key in set(keys) if key in self.positions)
+        if not positions:
+            return
+        for proxy in self.filters:
+            proxy.records_changed([self.rows[position] for position in positions])
+
+        start = previous = positions[0]
+        for position in positions[1:] + [None]:
+            if position == previous + 1:
+                previous = position
+                continue
+            self.dataChanged.emit(self.index(start, 0), self.index(previous, len(self.columns) - 1))
+            start = previous = position
+
+    def remove(self, keys):
+        keys = set(keys)
+        positions = sorted((self.positions[key] for key in keys if key in self.positions), reverse=True)
+        if not positions:
+            return
+        for position in positions:
+            self.beginRemoveRows(QModelIndex(), position, position)
+            key = self.rows[position][self.key]
+            del self.rows[position]
+            del self.search_keys[key]
+            self.endRemoveRows()
+        self.reindex()
+        for proxy in self.filters:
+            proxy.records_removed(keys)
+
+    def apply_delta(self, delta):
+        self.remove(delta['deleted'])
+        self.upsert(delta['upserted'])
+
+# Фильтр и сортировка поверх RecordsModel. Строка видна, если запись проходит condition окна
+# (постоянное условие) и её строка поиска содержит запрос. Ключи подходящих записей хранятся:
+# когда запрос только дополняется, проверяются лишь записи, подходившие под прежний запрос.
+class RecordsFilter(QSortFilterProxyModel):
+    def __init__(self, source, condition=None, parent=None):
+        super().__init__(parent)
+        self.condition = condition
+        self.query = ''
+        # Ключи записей, подходящих под запрос; None - запроса нет.
+        self.accepted = None
+        self.source = source
+        source.filters.append(self)
+        self.setSourceModel(source)
+        self.setSortRole(RecordsModel.SortRole)
+        self.setDynamicSortFilter(True)
+
+    def matches(self, record):
+        if self.condition is not None and not self.condition(record):
+            return False
+        return self.query in self.source.search_keys[record[self.source.key]]
+
+    def set_query(self, text):
+        query = search_key(text.strip())
+        if query == self.query:
+            return
+        previous, self.query = self.query, query
+        if previous and previous in query and self.accepted is not None:
+            search_keys = self.source.search_keys
+            self.accepted = {key for key in self.accepted if query in search_keys[key]}
+        else:
+            self.refilter()
+        self.invalidateFilter()
+
+    # Результат поиска, найденный в другом месте (на сервере): видны только записи с этими ключами.
+    def set_found(self, text, keys):
+        self.query = search_key(text.strip())
+        self.accepted = {
+            key for key in keys
+            if key in self.source.positions and (self.condition is None or self.condition(self.source.get(key)))
+        }
+        self.invalidateFilter()
+
+    # Полный пересчёт по текущему запросу (после загрузки всех строк модели).
+    def refilter(self):
+        if not self.query:
+            self.accepted = None
+            return
+        query = self.query
+        self.accepted = {key for key, text in self.source.search_keys.items() if query in text}
+        if self.condition is not None:
+            self.accepted = {key for key in self.accepted if self.condition(self.source.get(key))}
+
+    def records_changed(self, records):
+        if self.accepted is None:
+            return
+        for record in records:
+            if self.matches(record):
+                self.accepted.add(record[self.source.key])
+            else:
+                self.accepted.discard(record[self.source.key])
+
+    def records_removed(self, keys):
+        if self.accepted is not None:
+            self.accepted.difference_update(keys)
+
+    # Вызывается для каждой строки модели, поэтому внутри только поиск ключа в множестве.
+    def filterAcceptsRow(self, source_row, source_parent):
+        record = self.source.rows[source_row]
+        if self.accepted is not None:
+            return record[self.source.key] in self.accepted
+        return self.condition is None or self.condition(record)
+
+# Записи выделенных строк таблицы.
+def selected_records(view):
+    return [index.data(RecordsModel.RecordRole) for index in view.selectionModel().selectedRows()]
+
+# Представление для RecordsFilter: выделение строками, без редактирования, сортировка по щелчку
+# на заголовке (до первого щелчка строки идут в исходном порядке).
+def records_view(proxy):
+    view = QTableView()
+    view.setModel(proxy)
+    view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+    view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+    view.verticalHeader().setVisible(False)
+    view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+    view.setSortingEnabled(True)
+    return view
+
+BOOK_COLUMNS = [('Код', 'code'), ('Название', 'name'), ('Автор', 'author')]
+
 # ======
 # Окно оформления чит. дневника.
 # ======
@@ -94,14 +647,24 @@ class TicketWindow(QWidget):
         self.resize(1200, 800)
 
         # Данные
-        self.all_readers = []
-        self.available_books_source = []
-        self.current_available_books = []
-        self.selected_books = []
+        self.readers_model = RecordsModel(
+            [('№', 'card_number'), ('Фамилия', 'surname'), ('Имя', 'name'), ('Телефон', 'phone')], 'card_number', ('surname',)
+        )
+        self.readers_filter = RecordsFilter(self.readers_model, lambda r: r.get('role') == 'Читатель')
+        # Доступные и выбранные книги - одна модель с двумя фильтрами. Выбор хранится в словаре
+        # код -> книга (в порядке выбора), поэтому перенос книги не сдвигает строки модели,
+        # а только перепроверяет её строку в обоих фильтрах.
+        self.selected = {}
+        self.books_model = RecordsModel(BOOK_COLUMNS, 'code', ('name', 'code'))
+        self.available_filter = RecordsFilter(self.books_model, lambda b: b['code'] not in self.selected)
+        self.selected_filter = RecordsFilter(self.books_model, lambda b: b['code'] in self.selected)
 
         self.selected_reader_id = None
+        self.readers_timer = debounce(self, self.filter_readers)
+        self.books_timer = debounce(self, self.filter_available_books)
 
         self.setup_ui()
+        api_service.listeners.append(self.on_changes)
         self.refresh_data()
 
     def setup_ui(self):
@@ -117,18 +680,14 @@ class TicketWindow(QWidget):
 
         self.reader_search = QLineEdit()
         self.reader_search.setPlaceholderText("Поиск читателя...")
-        self.reader_search.textChanged.connect(self.filter_readers)
+        self.reader_search.textChanged.connect(self.readers_timer.start)
         readers_layout.addWidget(self.reader_search)
 
-        self.table_readers = QTableWidget()
-        self.table_readers.setColumnCount(4)
-        self.table_readers.setHorizontalHeaderLabels(['№', 'Фамилия', 'Имя', 'Телефон'])
+        self.table_readers = records_view(self.readers_filter)
         self.table_readers.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
-        self.table_readers.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.table_readers.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
-        self.table_readers.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.table_readers.setMaximumHeight(200)
-        self.table_readers.itemClicked.connect(self.on_reader_clicked)
+        self.table_readers.clicked.connect(self.on_reader_clicked)
         readers_layout.addWidget(self.table_readers)
 
         main_layout.addWidget(readers_group)
@@ -147,14 +706,10 @@ class TicketWindow(QWidget):
         lbl_av = QLabel("Доступные книги")
         self.input_search_book = QLineEdit()
         self.input_search_book.setPlaceholderText("Поиск книги...")
-        self.input_search_book.textChanged.connect(self.filter_available_books)
+        self.input_search_book.textChanged.connect(self.books_timer.start)
 
-        self.table_available = QTableWidget()
-        self.table_available.setColumnCount(3)
-        self.table_available.setHorizontalHeaderLabels(['Код', 'Название', 'Автор'])
+        self.table_available = records_view(self.available_filter)
         self.table_available.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
-        self.table_available.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
-        self.table_available.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
 
         left_box.addWidget(lbl_av)
         left_box.addWidget(self.input_search_book)
@@ -180,12 +735,8 @@ class TicketWindow(QWidget):
         right_box = QVBoxLayout()
         lbl_sel = QLabel("Выбранные к выдаче")
 
-        self.table_selected = QTableWidget()
-        self.table_selected.setColumnCount(3)
-        self.table_selected.setHorizontalHeaderLabels(['Код', 'Название', 'Автор'])
+        self.table_selected = records_view(self.selected_filter)
         self.table_selected.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
-        self.table_selected.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
-        self.table_selected.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
 
         right_box.addWidget(lbl_sel)
         right_box.addWidget(self.table_selected)
@@ -223,107 +774,75 @@ class TicketWindow(QWidget):
     def refresh_data(self):
         asyncio.create_task(self.load_all())
 
-    async def load_all(self):
-        readers = await api_service.get_all_readers()
-        if isinstance(readers, list):
-            self.all_readers = readers
-            self.filter_readers()
-
-        books = await api_service.get_available_books()
-        if isinstance(books, list):
-            self.available_books_source = books
-            self.current_available_books = list(self.available_books_source)
-            self.selected_books = []
-            self.update_books_tables()
+    def closeEvent(self, event):
+        if self.on_changes in api_service.listeners:
+            api_service.listeners.remove(self.on_changes)
+        super().closeEvent(event)
 
-    def filter_readers(self):
-        text = self.reader_search.text().lower().strip()
+    # Таблицы сразу строятся из локальной копии; сервер присылает только изменения
+    # с прошлой синхронизации, и они приходят в on_changes.
+    async def load_all(self):
+        self.readers_model.set_rows(api_service.replica_readers())
+        self.selected = {}
+        self.books_model.set_rows(api_service.replica_available_books())
+        await api_service.sync()
+
+    # Изменения, пришедшие от сервера: выданные другими книги сразу пропадают из списков.
+    def on_changes(self, data):
+        changes = data['changes']
+        if data['reset']:
+            self.readers_model.set_rows(api_service.replica_readers())
+        else:
+            self.readers_model.apply_delta(changes['readers'])
 
-        self.table_readers.setRowCount(0)
-        from PyQt6.QtWidgets import QTableWidgetItem
+        books_changed = any(changes[name]['upserted'] or changes[name]['deleted'] for name in ('books', 'tickets'))
+        if not data['reset'] and not books_changed:
+            return
 
-        for r in self.all_readers:
-            if text and (text not in r['surname'].lower()):
-                continue
+        available = {b['code']: b for b in api_service.replica_available_books()}
+        taken = [code for code in self.selected if code not in available]
+        self.selected = {code: available[code] for code in self.selected if code in available}
+        self.books_model.remove([code for code in self.books_model.positions if code not in available])
+        self.books_model.upsert(available.values())
 
-            row = self.table_readers.rowCount()
-            self.table_readers.insertRow(row)
+        if taken:
+            codes = ', '.join(taken)
+            QTimer.singleShot(0, lambda: QMessageBox.warning(self, 'Внимание', f'Книги уже выданы другому читателю: {codes}'))
 
-            self.table_readers.setItem(row, 0, QTableWidgetItem(str(r['card_number'])))
-            self.table_readers.setItem(row, 1, QTableWidgetItem(r['surname']))
-            self.table_readers.setItem(row, 2, QTableWidgetItem(r['name']))
-            self.table_readers.setItem(row, 3, QTableWidgetItem(r['phone']))
+    def filter_readers(self):
+        self.readers_filter.set_query(self.reader_search.text())
 
-    def on_reader_clicked(self, item):
-        row = item.row()
-        card_num_str = self.table_readers.item(row, 0).text()
-        self.selected_reader_id = int(card_num_str)
+    def on_reader_clicked(self, index):
+        self.selected_reader_id = index.data(RecordsModel.RecordRole)['card_number']
 
     def filter_available_books(self):
-        text = self.input_search_book.text().lower().strip()
-
-        filtered = []
-        for b in self.current_available_books:
-            if not text or (text in b['name'].lower() or text in b['code'].lower()):
-                filtered.append(b)
-
-        self.populate_table(self.table_available, filtered)
-
-    def update_books_tables(self):
-        self.filter_available_books()
-        self.populate_table(self.table_selected, self.selected_books)
-
-    def populate_table(self, table, data_list):
-        from PyQt6.QtWidgets import QTableWidgetItem
-        table.setRowCount(0)
-        for b in data_list:
-            row = table.rowCount()
-            table.insertRow(row)
-            table.setItem(row, 0, QTableWidgetItem(b['code']))
-            table.setItem(row, 1, QTableWidgetItem(b['name']))
-            table.setItem(row, 2, QTableWidgetItem(b['author']))
-            table.item(row, 0).setData(Qt.ItemDataRole.UserRole, b)
+        self.available_filter.set_query(self.input_search_book.text())
 
     def move_to_selected(self):
-        rows = sorted(set(index.row() for index in self.table_available.selectedIndexes()), reverse=True)
-        if not rows: return
-
-        for row in rows:
-            book_item = self.table_available.item(row, 0)
-            code = book_item.text()
+        books = selected_records(self.table_available)
+        if not books: return
 
-            book_obj = next((b for b in self.current_available_books if b['code'] == code), None)
-
-            if book_obj:
-                self.current_available_books.remove(book_obj)
-                self.selected_books.append(book_obj)
-
-        self.update_books_tables()
+        self.selected.update((b['code'], b) for b in books)
+        self.books_model.refresh([b['code'] for b in books])
 
     def move_to_available(self):
-        rows = sorted(set(index.row() for index in self.table_selected.selectedIndexes()), reverse=True)
-        if not rows: return
-
-        for row in rows:
-            code = self.table_selected.item(row, 0).text()
-            book_obj = next((b for b in self.selected_books if b['code'] == code), None)
+        books = selected_records(self.table_selected)
+        if not books: return
 
-            if book_obj:
-                self.selected_books.remove(book_obj)
-                self.current_available_books.append(book_obj)
-
-        self.update_books_tables()
+        for b in books:
+            self.selected.pop(b['code'], None)
+        self.books_model.refresh([b['code'] for b in books])
 
     def submit_ticket(self):
         if not self.selected_reader_id:
             QMessageBox.warning(self, "Ошибка", "Выберите читателя!")
             return
 
-        if not self.selected_books:
+        if not self.selected:
             QMessageBox.warning(self, "Ошибка", "Выберите хотя бы одну книгу!")
             return
 
-        book_codes = [b['code'] for b in self.selected_books]
+        book_codes = list(self.selected)
 
         payload = {
             "reader_card_number": self.selected_reader_id,
@@ -352,11 +871,21 @@ class BooksWindow(QWidget):
         super().__init__()
         self.setWindowTitle('Управление книгами')
         self.resize(1100, 600)
-        self.all_books = []
-        self.filtered_books = []
+        self.books_model = RecordsModel([
+            ('Код', 'code'), ('Автор', 'author'), ('Название', 'name'), ('Год', 'year_publication'),
+            ('Аннотация', 'sign_novelty_and_annotations')
+        ], 'code', ('name', 'code'))
+        self.books_filter = RecordsFilter(self.books_model)
+        self.filter_timer = debounce(self, self.apply_filter)
         self.setup_ui()
+        api_service.listeners.append(self.on_changes)
         self.refresh_data()
 
+    def closeEvent(self, event):
+        if self.on_changes in api_service.listeners:
+            api_service.listeners.remove(self.on_changes)
+        super().closeEvent(event)
+
     def setup_ui(self):
         main_layout = QHBoxLayout(self)
 
@@ -413,18 +942,12 @@ class BooksWindow(QWidget):
 
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText('Поиск по названию или коду...')
-        self.search_input.textChanged.connect(self.apply_filter)
+        self.search_input.textChanged.connect(self.filter_timer.start)
         right_layout.addWidget(self.search_input)
 
-        self.table = QTableWidget()
-        self.table.setColumnCount(5)
-        self.table.setHorizontalHeaderLabels(['Код', 'Автор', 'Название', 'Год', 'Аннотация'])
-
+        self.table = records_view(self.books_filter)
         self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)  # Название тянется
         self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)  # Код по размеру
-
-        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
-        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         right_layout.addWidget(self.table)
 
         btn_refresh = QPushButton("Обновить список")
@@ -439,33 +962,33 @@ class BooksWindow(QWidget):
         asyncio.create_task(self.load_books())
 
     async def load_books(self):
-        data = await api_service.get_all_books()
-        if isinstance(data, dict) and 'message' in data:
-            return
-        self.all_books = data
-        self.apply_filter()
+        self.books_model.set_rows(api_service.replica_books())
+        await api_service.sync()
+
+    # Изменения, пришедшие от сервера.
+    def on_changes(self, data):
+        if data['reset']:
+            self.books_model.set_rows(api_service.replica_books())
+        else:
+            self.books_model.apply_delta(data['changes']['books'])
 
+    # Большой каталог ищется на сервере по индексу, остальное - фильтром по локальной копии.
     def apply_filter(self):
-        text = self.search_input.text().lower().strip()
-        self.filtered_books = []
-        for b in self.all_books:
-            b_name = b.get('name', '').lower()
-            b_code = b.get('code', '').lower()
-            if not text or text in b_name or text in b_code:
-                self.filtered_books.append(b)
-        self.populate_table()
-
-    def populate_table(self):
-        from PyQt6.QtWidgets import QTableWidgetItem
-        self.table.setRowCount(0)
-        for b in self.filtered_books:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            self.table.setItem(row, 0, QTableWidgetItem(str(b.get('code', ''))))
-            self.table.setItem(row, 1, QTableWidgetItem(str(b.get('author', ''))))
-            self.table.setItem(row, 2, QTableWidgetItem(str(b.get('name', ''))))
-            self.table.setItem(row, 3, QTableWidgetItem(str(b.get('year_publication', ''))))
-            self.table.setItem(row, 4, QTableWidgetItem(str(b.get('sign_novelty_and_annotations', ''))))
+        text = self.search_input.text()
+        if len(self.books_model.rows) >= SERVER_SEARCH_MIN_ROWS and len(text.strip()) >= 3:
+            asyncio.create_task(self.search_on_server(text))
+        else:
+            self.books_filter.set_query(text)
+
+    # Ответ на устаревший запрос (текст уже изменился) отбрасывается.
+    async def search_on_server(self, text):
+        found = await api_service.search_books(text.strip(), {'limit': SERVER_SEARCH_LIMIT, 'fields': 'code'})
+        if text != self.search_input.text():
+            return
+        if isinstance(found, list):
+            self.books_filter.set_found(text, [b['code'] for b in found])
+        else:
+            self.books_filter.set_query(text)
 
     def on_add_click(self):
         payload = {
@@ -510,11 +1033,21 @@ class ReadersWindow(QWidget):
         super().__init__()
         self.setWindowTitle('Управление читателями')
         self.resize(1000, 600)
-        self.all_readers = []
-        self.filtered_readers = []
+        self.readers_model = RecordsModel([
+            ('№ Билета', 'card_number'), ('Фамилия', 'surname'), ('Имя', 'name'), ('Отчество', 'patronymic'),
+            ('Адрес', 'address'), ('Телефон', 'phone')
+        ], 'card_number', ('surname', 'card_number'))
+        self.readers_filter = RecordsFilter(self.readers_model, lambda r: r.get('role') == 'Читатель')
+        self.filter_timer = debounce(self, self.apply_filter)
         self.setup_ui()
+        api_service.listeners.append(self.on_changes)
         self.refresh_data()
 
+    def closeEvent(self, event):
+        if self.on_changes in api_service.listeners:
+            api_service.listeners.remove(self.on_changes)
+        super().closeEvent(event)
+
     def setup_ui(self):
         main_layout = QHBoxLayout(self)
 
@@ -569,17 +1102,13 @@ class ReadersWindow(QWidget):
 
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText('Поиск по фамилии или номеру билета..')
-        self.search_input.textChanged.connect(self.apply_filter)
+        self.search_input.textChanged.connect(self.filter_timer.start)
         right_layout.addWidget(self.search_input)
 
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(['№ Билета', 'Фамилия', 'Имя', 'Отчество', 'Адрес', 'Телефон'])
+        self.table = records_view(self.readers_filter)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)  # Растягиваем все колонки
         self.table.horizontalHeader().setSectionResizeMode(0,
                                                            QHeaderView.ResizeMode.ResizeToContents)  # А номер билета по контенту
-        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
-        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         right_layout.addWidget(self.table)
 
         refresh_btn = QPushButton("Обновить таблицу")
@@ -594,42 +1123,33 @@ class ReadersWindow(QWidget):
         asyncio.create_task(self.load_readers())
 
     async def load_readers(self):
-        data = await api_service.get_all_readers()
-
-        if isinstance(data, dict) and 'message' in data:
-            QMessageBox.warning(self, 'Ошибка', data.get('message', 'Error'))
-            return
-
-        self.all_readers = data
-        self.apply_filter()
+        self.readers_model.set_rows(api_service.replica_readers())
+        if not await api_service.sync():
+            QMessageBox.warning(self, 'Ошибка', 'Не удалось получить данные с сервера')
+
+    # Изменения, пришедшие от сервера.
+    def on_changes(self, data):
+        if data['reset']:
+            self.readers_model.set_rows(api_service.replica_readers())
+        else:
+            self.readers_model.apply_delta(data['changes']['readers'])
 
     def apply_filter(self):
-        search_text = self.search_input.text().lower().strip()
-
-        self.filtered_readers = []
-        for reader in self.all_readers:
-            r_surname = str(reader.get('surname', '')).lower()
-            r_card = str(reader.get('card_number', ''))
-
-            if not search_text or search_text in r_surname or search_text in r_card:
-                self.filtered_readers.append(reader)
-
-        self.populate_table()
-
-    def populate_table(self):
-        from PyQt6.QtWidgets import QTableWidgetItem
-
-        self.table.setRowCount(0)
-        for reader in self.filtered_readers:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
+        text = self.search_input.text()
+        if len(self.readers_model.rows) >= SERVER_SEARCH_MIN_ROWS and len(text.strip()) >= 3:
+            asyncio.create_task(self.search_on_server(text))
+        else:
+            self.readers_filter.set_query(text)
 
-            self.table.setItem(row, 0, QTableWidgetItem(str(reader.get('card_number', ''))))
-            self.table.setItem(row, 1, QTableWidgetItem(str(reader.get('surname', ''))))
-            self.table.setItem(row, 2, QTableWidgetItem(str(reader.get('name', ''))))
-            self.table.setItem(row, 3, QTableWidgetItem(str(reader.get('patronymic', ''))))
-            self.table.setItem(row, 4, QTableWidgetItem(str(reader.get('address', ''))))
-            self.table.setItem(row, 5, QTableWidgetItem(str(reader.get('phone', ''))))
+    # Ответ на устаревший запрос (текст уже изменился) отбрасывается.
+    async def search_on_server(self, text):
+        found = await api_service.search_readers(text.strip(), {'limit': SERVER_SEARCH_LIMIT, 'fields': 'card_number'})
+        if text != self.search_input.text():
+            return
+        if isinstance(found, list):
+            self.readers_filter.set_found(text, [r['card_number'] for r in found])
+        else:
+            self.readers_filter.set_query(text)
 
     def on_add_click(self):
         payload = {
@@ -739,6 +1259,8 @@ class MainWindow(QMainWindow):
         self.modules.append(self.ticket_window)
 
     def logout(self):
+        asyncio.create_task(api_service.logout())
+
         for module in self.modules:
             module.close()
 
@@ -801,6 +1323,8 @@ class LoginWindow(QWidget):
         result = await api_service.login(login, password)
         self.set_loading(False)
         if result.get('success'):
+            # Изменения с других рабочих мест приходят сами, без кнопки «Обновить».
+            api_service.start_events()
             self.main_window = MainWindow()
             self.main_window.show()
             self.close()
@@ -50,6 +50,7 @@ class LoginActivity : AppCompatActivity() {
                             Toast.makeText(applicationContext, "Добро пожаловать, ${authResponse.user?.name} ${authResponse.user?.patronymic}!", Toast.LENGTH_SHORT).show()
                             val intent = Intent(this@LoginActivity, MainActivity::class.java)
                             intent.putExtra("CARD_NUMBER", authResponse.user?.cardNumber)
+                            intent.putExtra("TOKEN", authResponse.token)
                             startActivity(intent)
                             finish()
                         } else if (authResponse.success && authResponse.user?.role == "Администратор") {
@@ -28,6 +28,7 @@ class MainActivity : AppCompatActivity() {
     private lateinit var btnRefresh: ImageButton
 
     private var currentCardNumber: Int = -1
+    private var token: String? = null
 
     override fun onCreate(savedInstanceState: Bundle?) {
         super.onCreate(savedInstanceState)
@@ -44,6 +45,7 @@ class MainActivity : AppCompatActivity() {
         recyclerView.adapter = adapter
 
         currentCardNumber = intent.getIntExtra("CARD_NUMBER", -1)
+        token = intent.getStringExtra("TOKEN")
 
         if (currentCardNumber != -1) {
             loadBooks()
@@ -74,7 +76,7 @@ class MainActivity : AppCompatActivity() {
         recyclerView.visibility = View.INVISIBLE
         tvEmpty.visibility = View.GONE
 
-        RetrofitClient.instance.getReaderBooks(currentCardNumber).enqueue(object : Callback<List<Book>> {
+        RetrofitClient.instance.getReaderBooks("Bearer $token", currentCardNumber).enqueue(object : Callback<List<Book>> {
             override fun onResponse(call: Call<List<Book>>, response: Response<List<Book>>) {
                 progressBar.visibility = View.GONE
 
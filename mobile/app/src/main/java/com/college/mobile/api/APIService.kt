@@ -5,11 +5,13 @@ import com.college.mobile.models.AuthResponse
 import com.college.mobile.models.Book
 import com.squareup.moshi.Moshi
 import com.squareup.moshi.kotlin.reflect.KotlinJsonAdapterFactory
+import okhttp3.OkHttpClient
 import retrofit2.Call
 import retrofit2.Retrofit
 import retrofit2.converter.moshi.MoshiConverterFactory
 import retrofit2.http.Body
 import retrofit2.http.GET
+import retrofit2.http.Header
 import retrofit2.http.POST
 import retrofit2.http.Path
 
@@ -18,9 +20,12 @@ interface APIService {
     @POST("auth/login")
     fun login(@Body request: AuthRequest): Call<AuthResponse>
 
-    // Получение книг читателя.
+    // Получение книг читателя (authorization - "Bearer <токен из ответа авторизации>").
     @GET("tickets/{card_number}/books")
-    fun getReaderBooks(@Path("card_number") cardNumber: Int): Call<List<Book>>
+    fun getReaderBooks(
+        @Header("Authorization") authorization: String,
+        @Path("card_number") cardNumber: Int,
+    ): Call<List<Book>>
 }
 
 object RetrofitClient {
@@ -30,9 +35,14 @@ object RetrofitClient {
         .add(KotlinJsonAdapterFactory())
         .build()
 
+    private val httpClient = OkHttpClient.Builder()
+        .addInterceptor(ETagInterceptor())
+        .build()
+
     val instance: APIService by lazy {
         Retrofit.Builder()
             .baseUrl(BASE_URL)
+            .client(httpClient)
             .addConverterFactory(MoshiConverterFactory.create(moshi))
             .build()
             .create(APIService::class.java)
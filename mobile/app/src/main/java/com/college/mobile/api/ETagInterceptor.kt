@@ -0,0 +1,52 @@
+package com.college.mobile.api
+
+import okhttp3.Interceptor
+import okhttp3.MediaType
+import okhttp3.Response
+import okhttp3.ResponseBody.Companion.toResponseBody
+import java.util.concurrent.ConcurrentHashMap
+
+// Запоминает ETag и тело последнего ответа на каждый GET и повторяет запрос с If-None-Match.
+// На 304 отдаёт сохранённое тело, так что Retrofit получает обычный успешный ответ.
+class ETagInterceptor : Interceptor {
+    private class Entry(val etag: String, val body: ByteArray, val contentType: MediaType?)
+
+    private val cache = ConcurrentHashMap<String, Entry>()
+
+    override fun intercept(chain: Interceptor.Chain): Response {
+        val request = chain.request()
+        if (request.method != "GET") {
+            return chain.proceed(request)
+        }
+
+        val key = request.url.toString()
+        val cached = cache[key]
+        val conditionalRequest = if (cached != null) {
+            request.newBuilder().header("If-None-Match", cached.etag).build()
+        } else {
+            request
+        }
+
+        val response = chain.proceed(conditionalRequest)
+
+        if (response.code == 304 && cached != null) {
+            response.close()
+            return response.newBuilder()
+                .code(200)
+                .message("OK")
+                .body(cached.body.toResponseBody(cached.contentType))
+                .build()
+        }
+
+        val etag = response.header("ETag")
+        val body = response.body
+        if (response.isSuccessful && etag != null && body != null) {
+            val contentType = body.contentType()
+            val bytes = body.bytes()
+            cache[key] = Entry(etag, bytes, contentType)
+            return response.newBuilder().body(bytes.toResponseBody(contentType)).build()
+        }
+
+        return response
+    }
+}
@@ -9,6 +9,7 @@ data class AuthResponse(
     @Json(name = "success") val success: Boolean,
     @Json(name = "message") val message: String,
     @Json(name = "user") val user: UserData? = null,
+    @Json(name = "token") val token: String? = null,
 )
 
 // Данные читателя.